@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+from time import time
+from typing import AsyncIterator
+from uuid import uuid4
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+STATES = ["pending", "downloaded", "converted", "uploaded", "added"]
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_TTL = 7 * 24 * 3600
+
+
+class BuildJournal:
+    def __init__(self, collection: AsyncIOMotorCollection) -> None:
+        self._collection = collection
+
+    async def create(
+        self,
+        owner_id: int,
+        chat_id: int,
+        message_id: int,
+        channel: str,
+        sticker_type: str,
+        stickers: dict[str, dict],
+    ) -> dict:
+        job = {
+            "_id": uuid4().hex,
+            "owner_id": owner_id,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "channel": channel,
+            "sticker_type": sticker_type,
+            "status": RUNNING,
+            "created": time(),
+            "updated": time(),
+            "order": list(stickers),
+            "sets": {},
+            "items": {
+                sticker_id: {"sticker": sticker, "state": "pending"}
+                for sticker_id, sticker in stickers.items()
+            },
+        }
+        await self._collection.insert_one(job)
+        return job
+
+    async def find_running(
+        self, owner_id: int, channel: str, sticker_type: str
+    ) -> dict | None:
+        return await self._collection.find_one(
+            {
+                "owner_id": owner_id,
+                "channel": channel,
+                "sticker_type": sticker_type,
+                "status": RUNNING,
+            },
+            {"_id": 1},
+        )
+
+    async def running(self) -> AsyncIterator[dict]:
+        async for job in self._collection.find({"status": RUNNING}):
+            yield job
+
+    async def mark(self, job: dict, sticker_id: str, state: str, **fields) -> None:
+        item = job["items"][sticker_id]
+        if STATES.index(state) < STATES.index(item["state"]):
+            return
+        item.update(fields, state=state)
+        update = {f"items.{sticker_id}.{key}": value for key, value in fields.items()}
+        update[f"items.{sticker_id}.state"] = state
+        update["updated"] = time()
+        await self._collection.update_one({"_id": job["_id"]}, {"$set": update})
+
+    async def add(
+        self, job: dict, index: int, name: str, sticker_ids: list[str]
+    ) -> None:
+        update = {f"items.{sticker_id}.state": "added" for sticker_id in sticker_ids}
+        update[f"sets.{index}"] = name
+        update["updated"] = time()
+        job["sets"][str(index)] = name
+        for sticker_id in sticker_ids:
+            job["items"][sticker_id]["state"] = "added"
+        await self._collection.update_one({"_id": job["_id"]}, {"$set": update})
+
+    async def finish(self, job: dict, status: str) -> None:
+        job["status"] = status
+        expires = datetime.now(timezone.utc) + timedelta(seconds=FINISHED_TTL)
+        await self._collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": status, "updated": time(), "expires": expires}},
+        )
+
+    def counts(self, job: dict) -> dict[str, int]:
+        counts = dict.fromkeys(STATES, 0)
+        for item in job["items"].values():
+            counts[item["state"]] += 1
+        return counts
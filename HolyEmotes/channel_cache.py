@@ -0,0 +1,83 @@
+import asyncio
+import json
+import traceback
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Hashable
+
+Loader = Callable[[], Awaitable[tuple[Any, float]]]
+Negative = Callable[[Any], bool]
+
+
+class ChannelCache:
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        stale: float = 24 * 3600,
+        negative: Negative = lambda value: False,
+    ) -> None:
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._stale = stale
+        self._negative = negative
+        self._entries: OrderedDict[
+            Hashable, tuple[Any, float, float, int]
+        ] = OrderedDict()
+        self._bytes = 0
+        self._loading: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, loader: Loader) -> Any:
+        entry = self._entries.get(key)
+        if entry:
+            value, expires, stale, _ = entry
+            now = monotonic()
+            if now < stale:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                if now >= expires:
+                    self.__load(key, loader)
+                return value
+        self.misses += 1
+        return await asyncio.shield(self.__load(key, loader))
+
+    def invalidate(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry[3]
+
+    def __load(self, key: Hashable, loader: Loader) -> asyncio.Task:
+        task = self._loading.get(key)
+        if not task:
+            task = asyncio.create_task(self.__fetch(key, loader))
+            self._loading[key] = task
+        return task
+
+    async def __fetch(self, key: Hashable, loader: Loader) -> Any:
+        try:
+            value, ttl = await loader()
+        except Exception:
+            entry = self._entries.get(key)
+            if not entry or self._negative(entry[0]):
+                raise
+            print(traceback.format_exc())
+            return entry[0]
+        finally:
+            del self._loading[key]
+        self.__store(key, value, ttl)
+        return value
+
+    def __store(self, key: Hashable, value: Any, ttl: float) -> None:
+        self.invalidate(key)
+        size = len(json.dumps(value, ensure_ascii=False))
+        if size > self._max_bytes:
+            return
+        expires = monotonic() + ttl
+        stale = expires if self._negative(value) else expires + self._stale
+        self._entries[key] = (value, expires, stale, size)
+        self._bytes += size
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            _, (_, _, _, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
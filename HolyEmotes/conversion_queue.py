@@ -0,0 +1,207 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from time import monotonic, time
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+
+from budget import BudgetExceededError
+from cache import CONVERSION_VERSION
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class ConversionFailedError(Exception):
+    pass
+
+
+class ConversionTimeoutError(Exception):
+    pass
+
+
+def job_id(content_hash: str, sticker_types: list[str]) -> str:
+    return f"{content_hash}-{'+'.join(sticker_types)}-v{CONVERSION_VERSION}"
+
+
+class ConversionQueue:
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        lease: float = 30.0,
+        max_attempts: int = 3,
+        max_wait: float = 600.0,
+        result_ttl: float = 3600.0,
+    ) -> None:
+        self._collection = collection
+        self._lease = lease
+        self._max_attempts = max_attempts
+        self._max_wait = max_wait
+        self._result_ttl = result_ttl
+
+    @property
+    def lease(self) -> float:
+        return self._lease
+
+    async def create_indexes(self) -> None:
+        await self._collection.create_index(
+            [("status", 1), ("priority", 1), ("created", 1)]
+        )
+        await self._collection.create_index([("status", 1), ("lease_expires", 1)])
+        await self._collection.create_index("expires", expireAfterSeconds=0)
+
+    async def submit(
+        self,
+        content: bytes,
+        content_hash: str,
+        sticker_types: list[str],
+        priority: int,
+    ) -> tuple[dict[str, tuple[bytes, str]], dict[str, Exception]]:
+        key = job_id(content_hash, sticker_types)
+        queued = {
+            "status": QUEUED,
+            "source": content,
+            "sticker_types": sticker_types,
+            "priority": priority,
+            "created": time(),
+            "attempts": 0,
+        }
+        await self._collection.update_one(
+            {"_id": key, "status": FAILED},
+            {
+                "$set": queued,
+                "$unset": {"error": "", "expires": "", "lease_owner": ""},
+            },
+        )
+        await self._collection.update_one(
+            {"_id": key}, {"$setOnInsert": queued}, upsert=True
+        )
+        deadline = monotonic() + self._max_wait
+        delay = 0.1
+        while True:
+            job = await self._collection.find_one(
+                {"_id": key}, {"source": 0, "lease_owner": 0}
+            )
+            if job is None:
+                raise ConversionFailedError(f"job {key} disappeared")
+            if job["status"] == DONE:
+                return self.__results(job)
+            if job["status"] == FAILED:
+                raise ConversionFailedError(job.get("error", "conversion failed"))
+            if monotonic() > deadline:
+                raise ConversionTimeoutError(f"job {key} is still {job['status']}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+    async def sweep(self) -> int:
+        result = await self._collection.update_many(
+            {
+                "status": LEASED,
+                "lease_expires": {"$lt": time()},
+                "attempts": {"$gte": self._max_attempts},
+            },
+            {
+                "$set": {
+                    "status": FAILED,
+                    "error": "worker lease expired too many times",
+                    "expires": datetime.now(timezone.utc)
+                    + timedelta(seconds=self._result_ttl),
+                },
+                "$unset": {"source": ""},
+            },
+        )
+        return result.modified_count
+
+    async def claim(self, worker_id: str) -> dict | None:
+        now = time()
+        return await self._collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": QUEUED},
+                    {
+                        "status": LEASED,
+                        "lease_expires": {"$lt": now},
+                        "attempts": {"$lt": self._max_attempts},
+                    },
+                ]
+            },
+            {
+                "$set": {
+                    "status": LEASED,
+                    "lease_owner": worker_id,
+                    "lease_expires": now + self._lease,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", 1), ("created", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def heartbeat(self, job: dict, worker_id: str) -> bool:
+        result = await self._collection.update_one(
+            {"_id": job["_id"], "status": LEASED, "lease_owner": worker_id},
+            {"$set": {"lease_expires": time() + self._lease}},
+        )
+        return result.modified_count == 1
+
+    async def complete(
+        self,
+        job: dict,
+        worker_id: str,
+        results: dict[str, tuple[bytes, str]],
+        errors: dict[str, Exception],
+    ) -> None:
+        await self.__finish(
+            job,
+            worker_id,
+            {
+                "status": DONE,
+                "results": {
+                    sticker_type: {"content": content, "ext": ext}
+                    for sticker_type, (content, ext) in results.items()
+                },
+                "errors": {
+                    sticker_type: {"type": type(e).__name__, "message": str(e)}
+                    for sticker_type, e in errors.items()
+                },
+            },
+        )
+
+    async def fail(self, job: dict, worker_id: str, error: Exception) -> None:
+        if job["attempts"] < self._max_attempts:
+            await self._collection.update_one(
+                {"_id": job["_id"], "lease_owner": worker_id},
+                {"$set": {"status": QUEUED}, "$unset": {"lease_owner": ""}},
+            )
+            return
+        await self.__finish(
+            job, worker_id, {"status": FAILED, "error": f"{type(error).__name__}: {error}"}
+        )
+
+    async def __finish(self, job: dict, worker_id: str, update: dict) -> None:
+        update["expires"] = datetime.now(timezone.utc) + timedelta(
+            seconds=self._result_ttl
+        )
+        await self._collection.update_one(
+            {"_id": job["_id"], "lease_owner": worker_id},
+            {"$set": update, "$unset": {"source": "", "lease_expires": ""}},
+        )
+
+    def __results(
+        self, job: dict
+    ) -> tuple[dict[str, tuple[bytes, str]], dict[str, Exception]]:
+        results = {
+            sticker_type: (result["content"], result["ext"])
+            for sticker_type, result in job["results"].items()
+        }
+        errors = {}
+        for sticker_type, error in job["errors"].items():
+            if error["type"] == BudgetExceededError.__name__:
+                errors[sticker_type] = BudgetExceededError(error["message"])
+            else:
+                errors[sticker_type] = ConversionFailedError(
+                    f"{error['type']}: {error['message']}"
+                )
+        return results, errors
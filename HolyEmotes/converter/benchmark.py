@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+from fractions import Fraction
+from io import BytesIO
+from time import perf_counter
+from typing import Callable
+
+import av
+import numpy as np
+from PIL import Image
+
+from convert import MAX_SIZES, Converter
+from metrics import collect, cpu_seconds
+
+SEED = 1337
+STICKER_TYPES = ["regular", "custom_emoji"]
+COMPARED = ["wall_seconds", "cpu_seconds", "peak_rss_bytes", "output_bytes"]
+AV1_ENCODERS = ["libsvtav1", "libaom-av1", "librav1e"]
+MAX_AVIF_RATE = 200
+
+
+def render_frames(
+    width: int, height: int, count: int, alpha: bool, seed: int
+) -> list[Image.Image]:
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    radius = max(min(width, height) // 4, 2)
+    noise = rng.integers(0, 24, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for index in range(count):
+        phase = index / max(count, 1)
+        rgba = np.empty((height, width, 4), np.uint8)
+        rgba[..., 0] = (x * 255 // max(width - 1, 1) + int(phase * 255)) % 256
+        rgba[..., 1] = (y * 255 // max(height - 1, 1)) % 256
+        rgba[..., 2] = int(128 + 127 * np.sin(phase * 2 * np.pi))
+        rgba[..., :3] += noise
+        cx = int(width / 2 + (width / 3) * np.cos(phase * 2 * np.pi))
+        cy = int(height / 2 + (height / 3) * np.sin(phase * 2 * np.pi))
+        circle = (x - cx) ** 2 + (y - cy) ** 2 <= radius**2
+        rgba[circle, :3] = 255 - rgba[circle, :3]
+        rgba[..., 3] = 255
+        if alpha:
+            rgba[..., 3] = np.where(circle, 255, np.where((x + y + index) % 7, 0, 255))
+        frames.append(Image.fromarray(rgba, "RGBA"))
+    return frames
+
+
+def save_static(frames: list[Image.Image], format: str) -> bytes:
+    buffer = BytesIO()
+    frames[0].save(buffer, format)
+    return buffer.getvalue()
+
+
+def save_animation(
+    frames: list[Image.Image], durations: list[int], format: str
+) -> bytes:
+    buffer = BytesIO()
+    extra = {"disposal": 2} if format == "GIF" else {"lossless": False, "quality": 80}
+    frames[0].save(
+        buffer,
+        format,
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=0,
+        **extra,
+    )
+    return buffer.getvalue()
+
+
+def save_avif(frames: list[Image.Image], durations: list[int], alpha: bool) -> bytes:
+    available = [codec for codec in AV1_ENCODERS if codec in av.codecs_available]
+    if not available:
+        raise RuntimeError("no AV1 encoder available")
+    rate = Fraction(1000, max(math.gcd(*durations), 1000 // MAX_AVIF_RATE))
+    buffer = BytesIO()
+    with av.open(buffer, "w", format="avif") as container:
+        planes = [lambda image: image.convert("RGB")]
+        if alpha:
+            planes.append(lambda image: image.getchannel("A").convert("RGB"))
+        streams = []
+        for _ in planes:
+            stream = container.add_stream(available[0], rate=rate)
+            stream.width, stream.height = frames[0].size
+            stream.pix_fmt = "yuv420p"
+            stream.time_base = Fraction(1, 1000)
+            streams.append(stream)
+        pts = 0
+        for image, duration in zip(frames, durations):
+            for stream, plane in zip(streams, planes):
+                frame = av.VideoFrame.from_image(plane(image))
+                frame.pts = pts
+                frame.time_base = stream.time_base
+                container.mux(stream.encode(frame))
+            pts += duration
+        for stream in streams:
+            container.mux(stream.encode())
+    return buffer.getvalue()
+
+
+def uneven(count: int) -> list[int]:
+    pattern = [20, 20, 500, 30, 1000, 10, 70, 40]
+    return [pattern[i % len(pattern)] for i in range(count)]
+
+
+def corpus() -> dict[str, Callable[[], bytes]]:
+    def static(size, alpha, format):
+        return lambda: save_static(render_frames(*size, 1, alpha, SEED), format)
+
+    def animated(size, count, alpha, durations, format):
+        def build():
+            frames = render_frames(*size, count, alpha, SEED)
+            if format == "AVIF":
+                return save_avif(frames, durations, alpha)
+            return save_animation(frames, durations, format)
+
+        return build
+
+    return {
+        "static_png_alpha": static((112, 112), True, "PNG"),
+        "static_webp_opaque": static((112, 112), False, "WEBP"),
+        "static_png_tiny": static((16, 16), True, "PNG"),
+        "static_png_oversized": static((2048, 1024), False, "PNG"),
+        "gif_uniform_alpha": animated((112, 112), 30, True, [40] * 30, "GIF"),
+        "gif_uneven_opaque": animated((112, 112), 40, False, uneven(40), "GIF"),
+        "gif_many_frames": animated((112, 112), 300, True, [20] * 300, "GIF"),
+        "gif_tiny": animated((16, 16), 12, True, [100] * 12, "GIF"),
+        "webp_uniform_alpha": animated((128, 128), 30, True, [33] * 30, "WEBP"),
+        "webp_uneven_opaque": animated((128, 128), 40, False, uneven(40), "WEBP"),
+        "webp_oversized": animated((1024, 1024), 24, True, [50] * 24, "WEBP"),
+        "avif_uniform_opaque": animated((128, 128), 30, False, [40] * 30, "AVIF"),
+        "avif_uneven_opaque": animated((128, 128), 40, False, uneven(40), "AVIF"),
+        "avif_uniform_alpha": animated((128, 128), 30, True, [40] * 30, "AVIF"),
+    }
+
+
+def write_corpus(directory: str) -> dict[str, str | None]:
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name, build in corpus().items():
+        try:
+            content = build()
+        except Exception as e:
+            print(f"skipping {name}: {e}", file=sys.stderr)
+            paths[name] = None
+            continue
+        paths[name] = os.path.join(directory, name)
+        with open(paths[name], "wb") as f:
+            f.write(content)
+    return paths
+
+
+async def measure(path: str, sticker_type: str) -> dict:
+    with open(path, "rb") as f:
+        source = f.read()
+    converter = Converter(asyncio.get_running_loop(), source, sticker_type)
+    cpu = cpu_seconds()
+    started = perf_counter()
+    error = None
+    content = b""
+    with collect() as spans:
+        try:
+            content, _ = await converter.convert()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    stages = {}
+    for recorded in spans:
+        stages[recorded["stage"]] = stages.get(recorded["stage"], 0.0) + recorded["seconds"]
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return {
+        "wall_seconds": perf_counter() - started,
+        "cpu_seconds": cpu_seconds() - cpu,
+        "peak_rss_bytes": peak * 1024,
+        "stages": stages,
+        "intermediate_frames": sum(
+            recorded["frames"] or 0
+            for recorded in spans
+            if recorded["stage"] == "decode"
+        ),
+        "attempts": converter.attempts.get(sticker_type, 0),
+        "output_bytes": len(content),
+        "fits": bool(content) and len(content) <= MAX_SIZES[sticker_type],
+        "error": error,
+    }
+
+
+def run_case(path: str, sticker_type: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "case", path, sticker_type],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def summarize(runs: list[dict]) -> dict:
+    result = dict(runs[-1])
+    result["wall_seconds"] = statistics.median(run["wall_seconds"] for run in runs)
+    result["cpu_seconds"] = statistics.median(run["cpu_seconds"] for run in runs)
+    result["peak_rss_bytes"] = max(run["peak_rss_bytes"] for run in runs)
+    result["stages"] = {
+        stage: statistics.median(run["stages"].get(stage, 0.0) for run in runs)
+        for stage in runs[-1]["stages"]
+    }
+    result["repeat"] = len(runs)
+    return result
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        if previous["fits"] and not current["fits"]:
+            regressions.append(f"{key}: no longer fits ({current['error']})")
+        for metric in COMPARED:
+            before, after = previous[metric], current[metric]
+            if before and (after - before) / before > threshold:
+                regressions.append(
+                    f"{key}: {metric} {before:.4g} -> {after:.4g} "
+                    f"(+{(after - before) / before:.0%})"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    case = commands.add_parser("case")
+    case.add_argument("path")
+    case.add_argument("sticker_type", choices=STICKER_TYPES)
+    run = commands.add_parser("run")
+    run.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "holyemotes-bench"))
+    run.add_argument("--output", default="benchmark.json")
+    run.add_argument("--baseline")
+    run.add_argument("--threshold", type=float, default=0.10)
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--only", nargs="*")
+    args = parser.parse_args()
+
+    if args.command == "case":
+        print(json.dumps(asyncio.run(measure(args.path, args.sticker_type))))
+        return 0
+
+    results = {}
+    for name, path in write_corpus(args.corpus).items():
+        if path is None or (args.only and name not in args.only):
+            continue
+        for sticker_type in STICKER_TYPES:
+            key = f"{name}/{sticker_type}"
+            results[key] = summarize(
+                [run_case(path, sticker_type) for _ in range(args.repeat)]
+            )
+            result = results[key]
+            print(
+                f"{key:40} {result['wall_seconds']:8.3f}s "
+                f"{result['cpu_seconds']:8.3f}cpu "
+                f"{result['output_bytes']:>8}B "
+                f"{'fits' if result['fits'] else 'FAILS'}"
+            )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    for regression in regressions:
+        print(regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
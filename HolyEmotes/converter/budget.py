@@ -0,0 +1,106 @@
+import asyncio
+import math
+from typing import Awaitable, Callable, NamedTuple
+
+MIN_CRF = 10
+MAX_CRF = 63
+MIN_FPS = 10
+MIN_BITRATE = 16_000
+MAX_ATTEMPTS = 12
+HEADROOM = 0.92
+REFERENCE_CRF = 31
+REFERENCE_BITS_PER_PIXEL = 0.1
+ALPHA_OVERHEAD = 0.6
+
+
+class BudgetExceededError(Exception):
+    pass
+
+
+class EncodeParams(NamedTuple):
+    crf: int
+    bitrate: int
+    fps: int
+
+
+class EncodeResult(NamedTuple):
+    content: bytes
+    params: EncodeParams
+    attempts: int
+
+
+class BudgetEncoder:
+    def __init__(
+        self,
+        encode: Callable[[EncodeParams], Awaitable[bytes]],
+        max_size: int,
+        parallel: int = 2,
+    ) -> None:
+        self._encode = encode
+        self._max_size = max_size
+        self._parallel = parallel
+        self._attempts = 0
+
+    def predict(
+        self, size: tuple[int, int], duration: float, fps: int, alpha: bool = True
+    ) -> EncodeParams:
+        width, height = size
+        bitrate = self._max_size * 8 * HEADROOM / max(duration, 0.1)
+        if alpha:
+            # libvpx encodes the alpha plane as a second stream at the same rate
+            bitrate /= 1 + ALPHA_OVERHEAD
+        bits_per_pixel = bitrate / (width * height * fps)
+        crf = round(
+            REFERENCE_CRF + 6 * math.log2(REFERENCE_BITS_PER_PIXEL / bits_per_pixel)
+        )
+        return EncodeParams(
+            min(max(crf, MIN_CRF), MAX_CRF), max(int(bitrate), MIN_BITRATE), fps
+        )
+
+    async def encode(self, params: EncodeParams) -> EncodeResult:
+        self._attempts = 0
+        content = await self.__attempt(params)
+        while len(content) > self._max_size:
+            candidates = self.__candidates(params, len(content))
+            candidates = candidates[: MAX_ATTEMPTS - self._attempts]
+            if not candidates:
+                break
+            results = await asyncio.gather(
+                *(self.__attempt(candidate) for candidate in candidates)
+            )
+            for candidate, result in zip(candidates, results):
+                if len(result) <= self._max_size:
+                    return EncodeResult(result, candidate, self._attempts)
+            params, content = candidates[-1], results[-1]
+        else:
+            return EncodeResult(content, params, self._attempts)
+        raise BudgetExceededError(
+            f"no candidate under {self._max_size} bytes after {self._attempts} attempts"
+        )
+
+    def __candidates(self, params: EncodeParams, size: int) -> list[EncodeParams]:
+        ratio = self._max_size * HEADROOM / size
+        if params.bitrate <= MIN_BITRATE and params.crf >= MAX_CRF:
+            if params.fps <= MIN_FPS:
+                return []
+            fps = max(params.fps * 2 // 3, MIN_FPS)
+            ratio *= fps / params.fps
+            params = params._replace(
+                fps=fps, bitrate=params.bitrate * fps // params.fps
+            )
+        candidates = []
+        for i in range(self._parallel):
+            scale = ratio * 0.85**i
+            # VP9 output roughly halves for every +6 crf
+            crf = params.crf + math.ceil(-6 * math.log2(min(scale, 1)))
+            candidates.append(
+                params._replace(
+                    crf=min(max(crf, params.crf), MAX_CRF),
+                    bitrate=max(int(params.bitrate * scale), MIN_BITRATE),
+                )
+            )
+        return sorted(set(candidates), key=lambda candidate: -candidate.bitrate)
+
+    async def __attempt(self, params: EncodeParams) -> bytes:
+        self._attempts += 1
+        return await self._encode(params)
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+
+from formats.utils import run_function_async
+
+CONVERSION_VERSION = "1"
+
+
+def source_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def cache_key(content_hash: str, sticker_type: str) -> str:
+    return f"{content_hash}-{sticker_type}-v{CONVERSION_VERSION}"
+
+
+class ConversionCache:
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop, directory: str, max_bytes: int
+    ) -> None:
+        self._loop = loop
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._bytes = 0
+
+    async def open(self) -> None:
+        await run_function_async(self._loop, self.__scan)
+
+    async def get(self, key: str) -> tuple[bytes, str] | None:
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        self._entries.move_to_end(key)
+        try:
+            content = await run_function_async(self._loop, self.__read, entry[0])
+        except FileNotFoundError:
+            self.__forget(key)
+            return None
+        return content, entry[0].rsplit(".", 1)[-1]
+
+    async def put(self, key: str, content: bytes, ext: str) -> None:
+        if len(content) > self._max_bytes:
+            return
+        path = os.path.join(self._directory, f"{key}.{ext}")
+        await run_function_async(self._loop, self.__write, path, content)
+        self.__forget(key)
+        self._entries[key] = (path, len(content))
+        self._bytes += len(content)
+        evicted = self.__evict()
+        if evicted:
+            await run_function_async(self._loop, self.__remove, evicted)
+
+    def __evict(self) -> list[str]:
+        evicted = []
+        while self._bytes > self._max_bytes:
+            key, (path, _) = next(iter(self._entries.items()))
+            self.__forget(key)
+            evicted.append(path)
+        return evicted
+
+    def __remove(self, paths: list[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __forget(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry[1]
+
+    def __scan(self) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self._directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+            else:
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(files):
+            key = os.path.basename(path).rsplit(".", 1)[0]
+            self._entries[key] = (path, size)
+            self._bytes += size
+        self.__remove(self.__evict())
+
+    def __read(self, path: str) -> bytes:
+        with open(path, "rb") as f:
+            content = f.read()
+        os.utime(path)
+        return content
+
+    def __write(self, path: str, content: bytes) -> None:
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(content)
+        os.replace(temporary, path)
@@ -1,164 +1,275 @@
 import asyncio
-import glob
-from typing import Literal
-from tempfile import TemporaryDirectory
+import math
+import os
+from functools import partial
+from typing import TYPE_CHECKING, Literal
 
-import magic
-from PIL import Image, ImageSequence
+from budget import BudgetEncoder, BudgetExceededError, EncodeParams
+from encoders import EncoderError, get_encoder
+from formats import get_format
+from formats.utils import (
+    Source,
+    open_source,
+    read_header,
+    run_function_async,
+    timestamps_to_frames,
+)
+from metrics import span
+from probe import (
+    DECODE_TIMEOUT,
+    ENCODE_TIMEOUT,
+    LimitExceededError,
+    Probe,
+    check_canvas,
+    enforce,
+    probe,
+)
 
-from formats import FORMATS, Any
+if TYPE_CHECKING:
+    from encoders import Encoder
+    from formats import Format
 
 MAX_SIZE_STICKER = 200 * 1024
 MAX_SIZE_EMOJI = 60 * 1024
 MAX_DURATION = 3.00
 MAX_FPS = 30
 
+MAX_SIZES = {"regular": MAX_SIZE_STICKER, "custom_emoji": MAX_SIZE_EMOJI}
+
+ENCODER = os.getenv("ENCODER_BACKEND", "ffmpeg")
+
+StickerType = Literal["regular", "custom_emoji"]
+
 
 class Converter:
     def __init__(
         self,
         loop: asyncio.AbstractEventLoop,
-        file: str,
-        sticker_type: Literal["regular", "custom_emoji"],
+        source: Source,
+        sticker_type: StickerType,
+        encoder: str = ENCODER,
     ) -> None:
-        self._file = file
+        self._source = source
         self._sticker_type = sticker_type
-        if self._sticker_type == "regular":
-            self._max_size = MAX_SIZE_STICKER
-        else:
-            self._max_size = MAX_SIZE_EMOJI
         self._loop = loop
+        self._encoder: "Encoder" = get_encoder(encoder)(loop)
+        self._durations: list[int] = []
+        self._speed_up = 1.0
+        self._mime = ""
+        self.probe: Probe | None = None
+        self._sizes: dict[StickerType, tuple[int, int]] = {}
+        self._frames: dict[StickerType, dict[int, bytes]] = {}
+        self._format: "Format | None" = None
+        self._buffering = asyncio.Lock()
+        self.attempts: dict[StickerType, int] = {}
+        self.errors: dict[StickerType, BudgetExceededError | EncoderError] = {}
+
+    async def convert(self) -> tuple[bytes, str]:
+        results = await self.convert_renditions([self._sticker_type])
+        if self._sticker_type in self.errors:
+            raise self.errors[self._sticker_type]
+        return results[self._sticker_type]
+
+    async def convert_renditions(
+        self, sticker_types: list[StickerType]
+    ) -> dict[StickerType, tuple[bytes, str]]:
+        with span("conversion", True, types="+".join(sticker_types)) as conversion:
+            with span("mime_sniff"):
+                import magic
 
-    async def convert(self):
-        with TemporaryDirectory() as tmpdir:
-            print(tmpdir)
-            mime = magic.from_file(self._file, True).lower()
-            print(mime)
-            format = FORMATS.get(mime, Any)(self._loop, self._file, tmpdir)
-            print("extract_frames")
-            one_frame, total_frames = await format.extract_frames()
-            print("after extract_frames", one_frame, total_frames)
-            if not total_frames or total_frames == 1:
-                await format.close()
-                return await self.convert_to_webp(), "webp"
-            fps = min(1000 // one_frame, 30)
-            duration = total_frames / fps
+                mime = magic.from_buffer(read_header(self._source), True).lower()
+            conversion.labels["format"] = mime
+            try:
+                results = await self.__convert_renditions(mime, sticker_types)
+            except (LimitExceededError, EncoderError) as e:
+                self.errors.update(dict.fromkeys(sticker_types, e))
+                results = {}
+            conversion.output_bytes = sum(len(content) for content, _ in results.values())
+            return results
+
+    async def __convert_renditions(
+        self, mime: str, sticker_types: list[StickerType]
+    ) -> dict[StickerType, tuple[bytes, str]]:
+        with span("open", format=mime):
+            format = await run_function_async(
+                self._loop, get_format(mime), self._loop, self._source
+            )
+        try:
+            check_canvas(format.size)
+            with span("extract_frames", format=mime) as extract:
+                durations = await format.extract_frames()
+                extract.frames = len(durations)
+            self._mime = mime
+            self._sizes = {
+                sticker_type: self.__output_size(sticker_type, format.size)
+                for sticker_type in sticker_types
+            }
+            if len(durations) <= 1 or not sum(durations):
+                return await self.convert_to_webp(sticker_types)
+            one_frame = math.gcd(*durations)
+            fps = max(min(1000 // one_frame, MAX_FPS), 1)
+            duration = sum(durations) / 1000
             speed_up = None
             if duration >= MAX_DURATION:
                 speed_up = round((duration / (MAX_DURATION)), 5)
-            return await self.render(fps, tmpdir, speed_up), "webm"
-
-    async def convert_to_webp(self) -> bytes:
-        proc = await asyncio.create_subprocess_exec(
-            "ffmpeg",
-            "-hide_banner",
-            "-loglevel",
-            "error",
-            "-i",
-            self._file,
-            "-f",
-            "webp",
-            "-c:v",
-            "libwebp",
-            "-vf",
-            "scale=512:-2" if self._sticker_type == "regular" else "scale=100:100",
-            "-",
-            stdin=asyncio.subprocess.DEVNULL,
-            stdout=asyncio.subprocess.PIPE,
-            # stderr=asyncio.subprocess.DEVNULL,
-        )
-        converted, _ = await proc.communicate()
-        return converted
+                fps = min(round(fps * speed_up), MAX_FPS)
+            self._durations = durations
+            self._speed_up = speed_up or 1.0
+            frames = timestamps_to_frames(durations, fps, self._speed_up)
+            keep = [index for index, repeat in frames.items() if repeat or not index]
+            self.probe = probe(format.size, frames, keep, list(self._sizes.values()))
+            enforce(self.probe)
+            self._format = format
+            self._frames = {sticker_type: {} for sticker_type in self._sizes}
+            with span("decode", format=mime) as decode:
+                decode.frames = len(keep)
+                await self.__buffer_frames(keep)
+            results = await asyncio.gather(
+                *(
+                    self.__encode_rendition(sticker_type, fps, duration)
+                    for sticker_type in sticker_types
+                )
+            )
+            return {
+                sticker_type: (content, "webm")
+                for sticker_type, content in zip(sticker_types, results)
+                if content is not None
+            }
+        finally:
+            await format.close()
 
-    def get_frames(self, durations: list[int], tmpdir: str) -> int:
-        minimum = min(durations)
-        image = Image.open(self._file)
-        sequence = ImageSequence.Iterator(image)
-        index = 0
-        for i in range(len(durations)):
-            frame = sequence[i]
-            for _ in range(durations[i] // minimum):
-                frame.save(f"{tmpdir}/{str(index).zfill(8)}.png")
-                index += 1
-        return len(glob.glob(f"{tmpdir}/*"))
-
-    async def render(
-        self,
-        fps: int,
-        tmpdir: str,
-        speed_up: float = None,
-    ) -> bytes:
-        target_fps = min(round(fps * speed_up), MAX_FPS)
-        process = await asyncio.create_subprocess_exec(
-            "ffmpeg",
-            "-hide_banner",
-            "-loglevel",
-            "error",
-            "-framerate",
-            str(fps),
-            "-i",
-            f"{tmpdir}/%08d.png",
-            "-f",
-            "lavfi",
-            "-i",
-            "color=c=white@0.0,format=rgba",
-            "-shortest",
-            "-filter_complex",
-            (
-                "[0:v]"
-                + (
-                    "scale='if(gt(iw,ih),512,-1)':'(if(gt(ih,iw),512,-1))'"
-                    if self._sticker_type == "regular"
-                    else "scale=100:100"
+    async def convert_to_webp(
+        self, sticker_types: list[StickerType]
+    ) -> dict[StickerType, tuple[bytes, str]]:
+        from PIL import UnidentifiedImageError
+
+        try:
+            with span("encode_static", format=self._mime):
+                results = await run_function_async(
+                    self._loop, self.__encode_static, sticker_types
                 )
-                + "[scaled];"
-                + (
-                    f"[scaled]fps={target_fps}, setpts=(1/{speed_up})*PTS[speedup];[speedup]"
-                    if speed_up
-                    else "[scaled]"
+        except UnidentifiedImageError:
+            results = {}
+            for sticker_type in sticker_types:
+                converted = await self._encoder.encode_webp(
+                    self._source, self._sizes[sticker_type]
                 )
-                + "[1:v]overlay=shortest=1,format=yuva420p[out]"
-            ),
-            "-map",
-            "[out]",
-            "-c:v",
-            "libvpx-vp9",
-            "-f",
-            "webm",
-            "-pix_fmt",
-            "yuva420p",
-            "-crf",
-            "17",
-            "-b:v",
-            "50K" if self._sticker_type == "regular" else "20K",
-            "-maxrate",
-            "50K" if self._sticker_type == "regular" else "20K",
-            "-bufsize",
-            "50K" if self._sticker_type == "regular" else "20K",
-            "pipe:",
-            stdin=asyncio.subprocess.DEVNULL,
-            stdout=asyncio.subprocess.PIPE,
-            # stderr=asyncio.subprocess.DEVNULL,
+                if len(converted) > MAX_SIZES[sticker_type]:
+                    results[sticker_type] = BudgetExceededError(
+                        f"static output is {len(converted)} bytes, "
+                        f"limit is {MAX_SIZES[sticker_type]}"
+                    )
+                else:
+                    results[sticker_type] = (converted, 1)
+        converted = {}
+        for sticker_type, result in results.items():
+            if isinstance(result, BudgetExceededError):
+                self.errors[sticker_type] = result
+                continue
+            content, self.attempts[sticker_type] = result
+            converted[sticker_type] = (content, "webp")
+        return converted
+
+    async def render(self, sticker_type: StickerType, params: EncodeParams) -> bytes:
+        await self.__ensure_frames(params.fps)
+        try:
+            return await asyncio.wait_for(
+                self._encoder.encode_webm(
+                    self.__sequence(sticker_type, params.fps),
+                    self._sizes[sticker_type],
+                    params,
+                ),
+                ENCODE_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            raise LimitExceededError(f"encoding took longer than {ENCODE_TIMEOUT}s")
+
+    async def __encode_rendition(
+        self, sticker_type: StickerType, fps: int, duration: float
+    ) -> bytes | None:
+        encoder = BudgetEncoder(
+            partial(self.render, sticker_type), MAX_SIZES[sticker_type]
+        )
+        params = encoder.predict(
+            self._sizes[sticker_type], duration / self._speed_up, fps
         )
-        content, _ = await process.communicate()
-        return content
+        try:
+            with span("encode", format=self._mime, sticker_type=sticker_type) as encode:
+                encode.frames = sum(
+                    timestamps_to_frames(
+                        self._durations, params.fps, self._speed_up
+                    ).values()
+                )
+                result = await encoder.encode(params)
+                encode.output_bytes = len(result.content)
+        except (BudgetExceededError, EncoderError) as e:
+            self.errors[sticker_type] = e
+            return None
+        self.attempts[sticker_type] = result.attempts
+        return result.content
+
+    def __encode_static(
+        self, sticker_types: list[StickerType]
+    ) -> dict[StickerType, tuple[bytes, int] | BudgetExceededError]:
+        from PIL import Image
+
+        from static import encode_static
 
+        results = {}
+        with Image.open(open_source(self._source)) as image:
+            image = image.convert("RGBA")
+            for sticker_type in sticker_types:
+                try:
+                    results[sticker_type] = encode_static(
+                        image, self._sizes[sticker_type], MAX_SIZES[sticker_type]
+                    )
+                except BudgetExceededError as e:
+                    results[sticker_type] = e
+        return results
 
-if __name__ == "__main__":
+    async def __buffer_frames(self, keep: list[int]) -> None:
+        try:
+            await asyncio.wait_for(self.__read_frames(keep), DECODE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise LimitExceededError(f"decoding took longer than {DECODE_TIMEOUT}s")
 
-    def extract_id(url: str):
-        if "jtvnw.net" in url:
-            return url.split("/emoticons/v2/")[-1].split("/")[0]
-        else:
-            return url.split("emote/")[-1].split("/")[0]
+    async def __read_frames(self, keep: list[int]) -> None:
+        sticker_types = list(self._sizes)
+        sizes = list(self._sizes.values())
+        async for index, resized in self._format.frames(sizes, keep):
+            for sticker_type, frame in zip(sticker_types, resized):
+                self._frames[sticker_type][index] = frame
 
-    async def main():
-        loop = asyncio.get_event_loop()
-        conv = Converter(
-            loop, "/home/user/projects/7tvtotelegram/countdown.webp", "regular"
+    async def __ensure_frames(self, fps: int) -> None:
+        async with self._buffering:
+            buffered = next(iter(self._frames.values()))
+            frames = timestamps_to_frames(self._durations, fps, self._speed_up)
+            missing = [
+                index
+                for index, repeat in frames.items()
+                if repeat and index not in buffered
+            ]
+            if missing:
+                with span("decode", format=self._mime) as decode:
+                    decode.frames = len(missing)
+                    await self.__buffer_frames(missing)
+
+    def __output_size(
+        self, sticker_type: StickerType, size: tuple[int, int]
+    ) -> tuple[int, int]:
+        if sticker_type != "regular":
+            return 100, 100
+        width, height = size
+        if not width or not height:
+            raise ValueError("can't determine image size")
+        scale = 512 / max(width, height)
+        return (
+            max(round(width * scale / 2) * 2, 2),
+            max(round(height * scale / 2) * 2, 2),
         )
-        content, ext = await conv.convert()
-        with open(f"test.{ext}", "wb") as f:
-            f.write(content)
 
-    asyncio.run(main())
+    def __sequence(self, sticker_type: StickerType, fps: int) -> list[tuple[bytes, int]]:
+        frames = timestamps_to_frames(self._durations, fps, self._speed_up)
+        buffered = self._frames[sticker_type]
+        return [(buffered[index], repeat) for index, repeat in frames.items() if repeat]
+
@@ -0,0 +1,23 @@
+from importlib import import_module
+from typing import TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    from .ffmpeg import FFmpeg
+    from .pyav import PyAV
+
+    Encoder = Union[FFmpeg, PyAV]
+
+ENCODERS = {"ffmpeg": ("ffmpeg", "FFmpeg"), "pyav": ("pyav", "PyAV")}
+
+_loaded: dict[str, type] = {}
+
+
+class EncoderError(Exception):
+    pass
+
+
+def get_encoder(name: str) -> "type[Encoder]":
+    module, cls = ENCODERS[name]
+    if module not in _loaded:
+        _loaded[module] = getattr(import_module(f".{module}", __name__), cls)
+    return _loaded[module]
@@ -0,0 +1,142 @@
+import asyncio
+import os
+
+from budget import EncodeParams
+from encoders import EncoderError
+from formats.utils import Source
+from probe import LimitExceededError, limit_signal, limit_subprocess
+
+ffmpeg_slots = asyncio.Semaphore(os.cpu_count() or 1)
+
+
+class FFmpeg:
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    async def encode_webm(
+        self,
+        frames: list[tuple[bytes, int]],
+        size: tuple[int, int],
+        params: EncodeParams,
+    ) -> bytes:
+        async with ffmpeg_slots:
+            return await self.__encode_webm(frames, size, params)
+
+    async def encode_webp(self, source: Source, size: tuple[int, int]) -> bytes:
+        async with ffmpeg_slots:
+            return await self.__encode_webp(source, size)
+
+    async def __encode_webp(self, source: Source, size: tuple[int, int]) -> bytes:
+        width, height = size
+        piped = isinstance(source, bytes)
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-i",
+            "pipe:0" if piped else source,
+            "-f",
+            "webp",
+            "-c:v",
+            "libwebp",
+            "-vf",
+            f"scale={width}:{height}",
+            "-",
+            stdin=asyncio.subprocess.PIPE if piped else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            # stderr=asyncio.subprocess.DEVNULL,
+        )
+        limit_subprocess(proc.pid)
+        try:
+            converted, _ = await proc.communicate(source if piped else None)
+        finally:
+            self.__reap(proc)
+        self.__check(proc)
+        return converted
+
+    async def __encode_webm(
+        self,
+        frames: list[tuple[bytes, int]],
+        size: tuple[int, int],
+        params: EncodeParams,
+    ) -> bytes:
+        width, height = size
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgba",
+            "-video_size",
+            f"{width}x{height}",
+            "-framerate",
+            str(params.fps),
+            "-i",
+            "pipe:0",
+            "-f",
+            "lavfi",
+            "-i",
+            "color=c=white@0.0,format=rgba",
+            "-shortest",
+            "-filter_complex",
+            "[0:v][1:v]overlay=shortest=1,format=yuva420p[out]",
+            "-map",
+            "[out]",
+            "-c:v",
+            "libvpx-vp9",
+            "-f",
+            "webm",
+            "-pix_fmt",
+            "yuva420p",
+            "-crf",
+            str(params.crf),
+            "-b:v",
+            str(params.bitrate),
+            "-maxrate",
+            str(params.bitrate),
+            "-bufsize",
+            str(params.bitrate),
+            "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            # stderr=asyncio.subprocess.DEVNULL,
+        )
+        limit_subprocess(process.pid)
+        try:
+            content, _ = await asyncio.gather(
+                process.stdout.read(), self.__feed(process, frames)
+            )
+            await process.wait()
+        finally:
+            self.__reap(process)
+        self.__check(process)
+        return content
+
+    def __reap(self, process: asyncio.subprocess.Process) -> None:
+        if process.returncode is None:
+            process.kill()
+
+    def __check(self, process: asyncio.subprocess.Process) -> None:
+        if limit_signal(process.returncode):
+            raise LimitExceededError(
+                f"ffmpeg was killed by signal {-process.returncode}"
+            )
+        if process.returncode:
+            raise EncoderError(f"ffmpeg exited with {process.returncode}")
+
+    async def __feed(
+        self, process: asyncio.subprocess.Process, frames: list[tuple[bytes, int]]
+    ) -> None:
+        try:
+            for frame, repeat in frames:
+                for _ in range(repeat):
+                    process.stdin.write(frame)
+                    await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from fractions import Fraction
+from io import BytesIO
+
+import av
+import numpy as np
+
+from budget import EncodeParams
+from encoders import EncoderError
+from formats.utils import (
+    Source,
+    open_source,
+    run_function_async,
+    run_stoppable_async,
+)
+
+
+class PyAV:
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    async def encode_webm(
+        self,
+        frames: list[tuple[bytes, int]],
+        size: tuple[int, int],
+        params: EncodeParams,
+    ) -> bytes:
+        return await run_stoppable_async(
+            self._loop, self.__encode_webm, frames, size, params
+        )
+
+    async def encode_webp(self, source: Source, size: tuple[int, int]) -> bytes:
+        return await run_function_async(self._loop, self.__encode_webp, source, size)
+
+    def __encode_webp(self, source: Source, size: tuple[int, int]) -> bytes:
+        width, height = size
+        with av.open(open_source(source)) as decoder:
+            frame = next(decoder.decode(video=0))
+            frame = frame.reformat(width=width, height=height, format="bgra")
+        buffer = BytesIO()
+        with av.open(buffer, "w", format="webp") as container:
+            stream = container.add_stream("libwebp")
+            stream.width, stream.height = size
+            stream.pix_fmt = "bgra"
+            frame.pts = None
+            for packet in stream.encode(frame):
+                container.mux(packet)
+            for packet in stream.encode():
+                container.mux(packet)
+        return buffer.getvalue()
+
+    def __encode_webm(
+        self,
+        frames: list[tuple[bytes, int]],
+        size: tuple[int, int],
+        params: EncodeParams,
+        stop: threading.Event,
+    ) -> bytes:
+        width, height = size
+        time_base = Fraction(1, params.fps)
+        buffer = BytesIO()
+        with av.open(buffer, "w", format="webm") as container:
+            stream = container.add_stream("libvpx-vp9", rate=params.fps)
+            stream.width, stream.height = size
+            stream.pix_fmt = "yuva420p"
+            stream.bit_rate = params.bitrate
+            stream.codec_context.time_base = time_base
+            stream.options = {
+                "crf": str(params.crf),
+                "maxrate": str(params.bitrate),
+                "bufsize": str(params.bitrate),
+            }
+            pts = 0
+            frame = None
+            for data, repeat in frames:
+                if stop.is_set():
+                    raise EncoderError("encoding was cancelled")
+                if not repeat:
+                    continue
+                array = np.frombuffer(data, np.uint8).reshape(height, width, 4)
+                frame = av.VideoFrame.from_ndarray(array, format="rgba")
+                frame.pts, frame.time_base = pts, time_base
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+                pts += repeat
+            if frame is not None and frame.pts != pts - 1:
+                frame.pts = pts - 1
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+            for packet in stream.encode():
+                container.mux(packet)
+        return buffer.getvalue()
@@ -1,6 +1,26 @@
-from .any import Any
-from .avif import AVIF
-from .gif import GIF
-from .webp import WEBP
+from importlib import import_module
+from typing import TYPE_CHECKING, Union
 
-FORMATS = {"image/avif": AVIF, "image/gif": GIF, "image/webp": WEBP}
+if TYPE_CHECKING:
+    from .any import Any
+    from .avif import AVIF
+    from .gif import GIF
+    from .webp import WEBP
+
+    Format = Union[Any, AVIF, GIF, WEBP]
+
+FORMATS = {
+    "image/avif": ("avif", "AVIF"),
+    "image/gif": ("gif", "GIF"),
+    "image/webp": ("webp", "WEBP"),
+}
+FALLBACK = ("any", "Any")
+
+_loaded: dict[str, type] = {}
+
+
+def get_format(mime: str) -> "type[Format]":
+    module, name = FORMATS.get(mime, FALLBACK)
+    if module not in _loaded:
+        _loaded[module] = getattr(import_module(f".{module}", __name__), name)
+    return _loaded[module]
@@ -1,9 +1,28 @@
 import asyncio
+from typing import AsyncIterator
+
+from PIL import Image, UnidentifiedImageError
+
+from .utils import Source, open_source
+
 
 class Any:
-    def __init__(
-        self, loop: asyncio.AbstractEventLoop, file_path: str, tmpdir: str
-    ) -> None:
-        pass
+    def __init__(self, loop: asyncio.AbstractEventLoop, source: Source) -> None:
+        self.size: tuple[int, int] = (0, 0)
+        try:
+            with Image.open(open_source(source)) as image:
+                self.size = image.size
+        except (OSError, UnidentifiedImageError):
+            pass
 
-    
\ No newline at end of file
+    async def extract_frames(self) -> list[int]:
+        return []
+
+    async def frames(
+        self, sizes: list[tuple[int, int]], keep: list[int]
+    ) -> AsyncIterator[tuple[int, list[bytes]]]:
+        return
+        yield
+
+    async def close(self) -> None:
+        pass
@@ -1,22 +1,49 @@
 import asyncio
+import threading
+from collections import deque
+from typing import AsyncIterator, Iterator
 
 import av
+import numpy as np
 from av.video.stream import VideoStream
-from PIL import Image
 
-from .utils import run_function_async, durations_to_frames
+from .utils import Source, run_function_async, iterate_async, open_source
+
+
+DEPENDENT = 1 << 19
+
+
+def _is_alpha(stream: VideoStream) -> bool:
+    if int(getattr(stream, "disposition", 0)) & DEPENDENT:
+        return True
+    handler = stream.metadata.get("handler_name", "").lower()
+    if "alpha" in handler or "auxv" in handler:
+        return True
+    return (stream.codec_context.pix_fmt or "").startswith("gray")
 
 
 class AVIF:
-    def __init__(
-        self, loop: asyncio.AbstractEventLoop, file_path: str, tmpdir: str
-    ) -> None:
+    def __init__(self, loop: asyncio.AbstractEventLoop, source: Source) -> None:
         self._loop = loop
-        self._tmpdir = tmpdir
-        self._container = av.open(file_path)
+        self._container = av.open(open_source(source))
+        streams = list(self._container.streams.video)
+        sequences = [stream for stream in streams if stream.frames != 1] or streams
+        alpha = [stream for stream in sequences if _is_alpha(stream)]
+        colour = [stream for stream in sequences if stream not in alpha]
+        self._colour: VideoStream = (colour or sequences)[0]
+        self._alpha: VideoStream | None = alpha[0] if colour and alpha else None
+        self.size: tuple[int, int] = (self._colour.width, self._colour.height)
 
-    async def extract_frames(self) -> tuple[int, int]:
-        return await run_function_async(self._loop, self.__extract_frames)
+    async def extract_frames(self) -> list[int]:
+        return await run_function_async(self._loop, self.__get_durations)
+
+    def frames(
+        self, sizes: list[tuple[int, int]], keep: list[int]
+    ) -> AsyncIterator[tuple[int, list[bytes]]]:
+        stop = threading.Event()
+        return iterate_async(
+            self._loop, self.__iter_frames(sizes, keep, stop), stop
+        )
 
     async def close(self) -> None:
         return await run_function_async(self._loop, self.__close)
@@ -24,40 +51,63 @@ class AVIF:
     def __close(self) -> None:
         self._container.close()
 
-    def __extract_frames(self) -> tuple[int, int]:
-        streams_len = len(self._container.streams.video)
-        durations = self.__get_durations()
-        gcd, frames = durations_to_frames(durations)
-        file_index = 0
-        self._container.seek(0)
-        frames_stream = list(self._container.decode(video=streams_len - 2))
+    def __iter_frames(
+        self, sizes: list[tuple[int, int]], keep: list[int], stop: threading.Event
+    ) -> Iterator[tuple[int, list[bytes]]]:
+        if not keep:
+            return
+        wanted = set(keep)
+        buffers = [np.empty((height, width, 4), np.uint8) for width, height in sizes]
+        streams = [self._colour] + ([self._alpha] if self._alpha else [])
+        pending = {stream.index: deque() for stream in streams}
+        index = 0
         self._container.seek(0)
-        alpha_stream = list(self._container.decode(video=streams_len - 1))
-        for frame, alpha, repeat in zip(
-            frames_stream,
-            alpha_stream,
-            frames.values(),
-        ):
-            for _ in range(repeat):
-                image = frame.to_image()
-                alpha_image = Image.fromarray(alpha.to_ndarray(), "L")
-                image.putalpha(alpha_image)
-                image.save(f"{self._tmpdir}/{file_index:08d}.png")
-                file_index += 1
-        return gcd, file_index
+        for packet in self._container.demux(*streams):
+            if stop.is_set():
+                return
+            pending[packet.stream.index].extend(packet.decode())
+            while all(pending.values()):
+                frame = pending[self._colour.index].popleft()
+                alpha = pending[self._alpha.index].popleft() if self._alpha else None
+                if index in wanted:
+                    yield index, [
+                        self.__merge(frame, alpha, size, rgba)
+                        for size, rgba in zip(sizes, buffers)
+                    ]
+                if index == keep[-1]:
+                    return
+                index += 1
+
+    def __merge(
+        self,
+        frame: av.VideoFrame,
+        alpha: av.VideoFrame | None,
+        size: tuple[int, int],
+        rgba: np.ndarray,
+    ) -> bytes:
+        width, height = size
+        if alpha is None:
+            return frame.to_ndarray(width=width, height=height, format="rgba").tobytes()
+        rgba[..., :3] = frame.to_ndarray(width=width, height=height, format="rgb24")
+        rgba[..., 3] = alpha.to_ndarray(width=width, height=height, format="gray")
+        return rgba.tobytes()
 
     def __get_durations(self) -> list[int]:
-        durations = []
-        prev_duration = 0
+        time_base = self._colour.time_base
+        timestamps = []
+        last_duration = 0
         self._container.seek(0)
-        for i, frame in enumerate(
-            self._container.decode(video=len(self._container.streams.video) - 2)
-        ):
-            ms_duration = frame.pts * 10
-            if i == 0:
+        for packet in self._container.demux(self._colour):
+            if packet.pts is None:
                 continue
-            durations.append(ms_duration - prev_duration)
-            prev_duration = ms_duration
-        if self._container.duration:
-            durations.append(round(self._container.duration / 1000) - ms_duration)
+            timestamps.append(round(packet.pts * time_base * 1000))
+            if packet.duration:
+                last_duration = round(packet.duration * time_base * 1000)
+        if not timestamps:
+            return []
+        timestamps.sort()
+        durations = [end - start for start, end in zip(timestamps, timestamps[1:])]
+        if not last_duration and self._container.duration:
+            last_duration = round(self._container.duration / 1000) - timestamps[-1]
+        durations.append(max(last_duration, 0) or (durations[-1] if durations else 0))
         return durations
@@ -1,46 +1,51 @@
 import asyncio
+import threading
+from io import BytesIO
+from typing import AsyncIterator, Iterator
 
 from PIL import Image
 
-from .utils import run_function_async, durations_to_frames
+from .utils import (
+    Source,
+    iterate_async,
+    parse_gif,
+    read_source,
+    resize_frame,
+    run_function_async,
+)
 
 
 class GIF:
-    def __init__(
-        self, loop: asyncio.AbstractEventLoop, file_path: str, tmpdir: str
-    ) -> None:
+    def __init__(self, loop: asyncio.AbstractEventLoop, source: Source) -> None:
         self._loop = loop
-        self._tmpdir = tmpdir
-        self._image = Image.open(file_path)
-
-    async def extract_frames(self) -> tuple[int, int]:
-        return await run_function_async(self._loop, self.__extract_frames)
+        self._data = read_source(source)
+        self.info = parse_gif(self._data)
+        self._image = Image.open(BytesIO(self._data))
+        self.size: tuple[int, int] = self._image.size
+
+    async def extract_frames(self) -> list[int]:
+        return [frame.duration for frame in self.info.frames]
+
+    def frames(
+        self, sizes: list[tuple[int, int]], keep: list[int]
+    ) -> AsyncIterator[tuple[int, list[bytes]]]:
+        stop = threading.Event()
+        return iterate_async(
+            self._loop, self.__iter_frames(sizes, keep, stop), stop
+        )
 
     async def close(self) -> None:
         return await run_function_async(self._loop, self.__close)
 
-    def __extract_frames(self) -> tuple[int, int]:
-        durations = self.__get_durations()
-        gcd, frames = durations_to_frames(durations)
-        file_index = 0
-        for frame_index, repeat in frames.items():
+    def __iter_frames(
+        self, sizes: list[tuple[int, int]], keep: list[int], stop: threading.Event
+    ) -> Iterator[tuple[int, list[bytes]]]:
+        for frame_index in keep:
+            if stop.is_set():
+                return
             self._image.seek(frame_index)
-            for _ in range(repeat):
-                self._image.save(f"{self._tmpdir}/{file_index:08d}.png")
-                file_index += 1
-        return gcd, file_index
-
-    def __get_durations(self) -> list[int]:
-        durations = []
-        i = 0
-        while True:
-            try:
-                self._image.seek(i)
-                durations.append(self._image.info["duration"])
-                i += 1
-            except EOFError:
-                break
-        return durations
+            frame = self._image.convert("RGBA")
+            yield frame_index, [resize_frame(frame, size) for size in sizes]
 
     def __close(self):
         self._image.close()
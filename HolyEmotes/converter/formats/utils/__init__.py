@@ -1,2 +1,11 @@
-from .durations_to_frames import durations_to_frames
-from .sync_to_async import run_function_async
\ No newline at end of file
+from .timestamps import durations_to_timestamps, timestamps_to_frames
+from .sync_to_async import (
+    run_function_async,
+    run_stoppable_async,
+    iterate_async,
+    set_executor,
+)
+from .gif_parser import GIFFrame, GIFInfo, parse_gif
+from .webp_parser import WebPFrame, WebPInfo, parse_webp, truncate_webp
+from .resize import resize_frame, resize_image
+from .source import Source, open_source, read_header, read_source
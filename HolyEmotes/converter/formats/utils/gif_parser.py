@@ -0,0 +1,78 @@
+import struct
+from typing import NamedTuple
+
+GRAPHIC_CONTROL = 0xF9
+EXTENSION = 0x21
+IMAGE = 0x2C
+TRAILER = 0x3B
+
+
+class GIFFrame(NamedTuple):
+    x_offset: int
+    y_offset: int
+    width: int
+    height: int
+    duration: int
+    disposal: int
+
+
+class GIFInfo(NamedTuple):
+    width: int
+    height: int
+    frames: list[GIFFrame]
+
+
+def _skip_sub_blocks(data: bytes, offset: int) -> int:
+    while True:
+        if offset >= len(data):
+            raise ValueError("truncated GIF data block")
+        size = data[offset]
+        offset += 1
+        if not size:
+            return offset
+        offset += size
+        if offset > len(data):
+            raise ValueError("truncated GIF data block")
+
+
+def _color_table_size(packed: int) -> int:
+    return 3 * 2 ** ((packed & 0x07) + 1) if packed & 0x80 else 0
+
+
+def parse_gif(data: bytes) -> GIFInfo:
+    if data[:6] not in (b"GIF87a", b"GIF89a") or len(data) < 13:
+        raise ValueError("not a GIF file")
+    width, height, packed = struct.unpack_from("<HHB", data, 6)
+    offset = 13 + _color_table_size(packed)
+    duration = disposal = 0
+    frames = []
+    while offset < len(data):
+        block = data[offset]
+        if block == TRAILER:
+            break
+        try:
+            if block == EXTENSION:
+                label = data[offset + 1]
+                if label == GRAPHIC_CONTROL and offset + 7 < len(data):
+                    flags, delay = struct.unpack_from("<BH", data, offset + 3)
+                    disposal = (flags >> 2) & 0x07
+                    duration = delay * 10
+                offset = _skip_sub_blocks(data, offset + 2)
+            elif block == IMAGE:
+                if offset + 10 > len(data):
+                    raise ValueError("truncated GIF image descriptor")
+                x, y, w, h, packed = struct.unpack_from("<HHHHB", data, offset + 1)
+                offset = _skip_sub_blocks(
+                    data, offset + 11 + _color_table_size(packed)
+                )
+                frames.append(GIFFrame(x, y, w, h, duration, disposal))
+                duration = disposal = 0
+            else:
+                raise ValueError(f"unexpected GIF block 0x{block:02x}")
+        except (IndexError, ValueError):
+            if not frames:
+                raise
+            break
+    if not frames:
+        raise ValueError("GIF has no complete frames")
+    return GIFInfo(width, height, frames)
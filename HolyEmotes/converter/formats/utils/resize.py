@@ -0,0 +1,22 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+REDUCING_GAP = 2.0
+
+
+def resize_image(image: "Image.Image", size: tuple[int, int]) -> "Image.Image":
+    from PIL import Image
+
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    if image.size != size:
+        image = image.resize(
+            size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP
+        )
+    return image
+
+
+def resize_frame(image: "Image.Image", size: tuple[int, int]) -> bytes:
+    return resize_image(image, size).tobytes()
@@ -0,0 +1,24 @@
+from io import BytesIO
+from typing import BinaryIO, Union
+
+Source = Union[str, bytes]
+
+HEADER_SIZE = 2048
+
+
+def read_source(source: Source) -> bytes:
+    if isinstance(source, bytes):
+        return source
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def read_header(source: Source) -> bytes:
+    if isinstance(source, bytes):
+        return source[:HEADER_SIZE]
+    with open(source, "rb") as f:
+        return f.read(HEADER_SIZE)
+
+
+def open_source(source: Source) -> Union[str, BinaryIO]:
+    return BytesIO(source) if isinstance(source, bytes) else source
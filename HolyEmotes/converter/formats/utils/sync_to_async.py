@@ -1,7 +1,54 @@
+from concurrent.futures import Executor
 from functools import partial
+from typing import AsyncIterator, Iterator, TypeVar
 import asyncio
+import threading
+
+T = TypeVar("T")
+
+_executor: Executor | None = None
+
+
+def set_executor(executor: Executor | None) -> None:
+    global _executor
+    _executor = executor
 
 
 async def run_function_async(loop: asyncio.AbstractEventLoop, function, *args, **kwargs):
     function = partial(function, *args, **kwargs)
-    return await loop.run_in_executor(None, function)
+    return await loop.run_in_executor(_executor, function)
+
+
+async def run_stoppable_async(
+    loop: asyncio.AbstractEventLoop, function, *args, **kwargs
+):
+    stop = threading.Event()
+    future = loop.run_in_executor(
+        _executor, partial(function, *args, stop=stop, **kwargs)
+    )
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        stop.set()
+        await asyncio.wait({future})
+        raise
+
+
+async def iterate_async(
+    loop: asyncio.AbstractEventLoop,
+    iterator: Iterator[T],
+    stop: threading.Event | None = None,
+) -> AsyncIterator[T]:
+    sentinel = object()
+    while True:
+        future = loop.run_in_executor(_executor, next, iterator, sentinel)
+        try:
+            item = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if stop:
+                stop.set()
+            await asyncio.wait({future})
+            raise
+        if item is sentinel:
+            return
+        yield item
@@ -0,0 +1,20 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+
+def durations_to_timestamps(durations: list[int]) -> tuple[list[int], int]:
+    timestamps = list(accumulate(durations, initial=0))
+    total = timestamps.pop()
+    return timestamps, total
+
+
+def timestamps_to_frames(
+    durations: list[int], fps: int, speed_up: float = 1.0
+) -> dict[int, int]:
+    timestamps, total = durations_to_timestamps(durations)
+    frames = dict.fromkeys(range(len(durations)), 0)
+    output_frames = max(1, round(total / speed_up * fps / 1000))
+    for index in range(output_frames):
+        pts = index * 1000 * speed_up / fps
+        frames[bisect_right(timestamps, pts) - 1] += 1
+    return frames
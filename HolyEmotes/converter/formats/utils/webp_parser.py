@@ -0,0 +1,99 @@
+import struct
+from typing import NamedTuple
+
+ANIMATION_FLAG = 0x02
+
+
+class WebPFrame(NamedTuple):
+    x_offset: int
+    y_offset: int
+    width: int
+    height: int
+    duration: int
+    blend: bool
+    dispose: bool
+
+
+class WebPInfo(NamedTuple):
+    width: int
+    height: int
+    animated: bool
+    loop_count: int
+    background: int
+    frames: list[WebPFrame]
+    length: int
+
+
+def _uint24(data: bytes, offset: int) -> int:
+    return int.from_bytes(data[offset : offset + 3], "little")
+
+
+def _chunks(data: bytes, start: int, end: int):
+    offset = start
+    while offset + 8 <= end:
+        fourcc = data[offset : offset + 4]
+        (size,) = struct.unpack_from("<I", data, offset + 4)
+        payload = offset + 8
+        if payload + size > end:
+            raise ValueError(f"truncated {fourcc!r} chunk")
+        yield fourcc, payload, size
+        offset = payload + size + (size & 1)
+
+
+def _bitstream_size(data: bytes, fourcc: bytes, offset: int) -> tuple[int, int]:
+    if fourcc == b"VP8 ":
+        if data[offset + 3 : offset + 6] != b"\x9d\x01\x2a":
+            raise ValueError("invalid VP8 start code")
+        width, height = struct.unpack_from("<HH", data, offset + 6)
+        return width & 0x3FFF, height & 0x3FFF
+    if fourcc == b"VP8L":
+        if data[offset] != 0x2F:
+            raise ValueError("invalid VP8L signature")
+        (bits,) = struct.unpack_from("<I", data, offset + 1)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    raise ValueError(f"unexpected {fourcc!r} chunk")
+
+
+def parse_webp(data: bytes) -> WebPInfo:
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+        raise ValueError("not a RIFF WebP file")
+    (riff_size,) = struct.unpack_from("<I", data, 4)
+    end = min(riff_size + 8, len(data))
+    width = height = loop_count = background = 0
+    animated = False
+    frames = []
+    length = 12
+    try:
+        for fourcc, offset, size in _chunks(data, 12, end):
+            if fourcc == b"VP8X":
+                animated = bool(data[offset] & ANIMATION_FLAG)
+                width = _uint24(data, offset + 4) + 1
+                height = _uint24(data, offset + 7) + 1
+            elif fourcc == b"ANIM":
+                background, loop_count = struct.unpack_from("<IH", data, offset)
+            elif fourcc == b"ANMF":
+                flags = data[offset + 15]
+                frames.append(
+                    WebPFrame(
+                        x_offset=_uint24(data, offset) * 2,
+                        y_offset=_uint24(data, offset + 3) * 2,
+                        width=_uint24(data, offset + 6) + 1,
+                        height=_uint24(data, offset + 9) + 1,
+                        duration=_uint24(data, offset + 12),
+                        blend=not flags & 0x02,
+                        dispose=bool(flags & 0x01),
+                    )
+                )
+            elif fourcc in (b"VP8 ", b"VP8L") and not width:
+                width, height = _bitstream_size(data, fourcc, offset)
+            length = min(offset + size + (size & 1), end)
+    except (IndexError, ValueError, struct.error):
+        if not frames:
+            raise
+    return WebPInfo(width, height, animated, loop_count, background, frames, length)
+
+
+def truncate_webp(data: bytes, length: int) -> bytes:
+    if length >= len(data):
+        return data
+    return b"RIFF" + struct.pack("<I", length - 8) + data[8:length]
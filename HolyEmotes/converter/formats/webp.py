@@ -1,55 +1,53 @@
 import asyncio
+import threading
+from io import BytesIO
+from typing import AsyncIterator, Iterator
 
 from PIL import Image
 
-from .utils import run_function_async, durations_to_frames
+from .utils import (
+    Source,
+    iterate_async,
+    parse_webp,
+    read_source,
+    resize_frame,
+    run_function_async,
+    truncate_webp,
+)
 
 
 class WEBP:
-    def __init__(
-        self, loop: asyncio.AbstractEventLoop, file_path: str, tmpdir: str
-    ) -> None:
+    def __init__(self, loop: asyncio.AbstractEventLoop, source: Source) -> None:
         self._loop = loop
-        self._file_path = file_path
-        self._tmpdir = tmpdir
-        self._image = Image.open(file_path)
-
-    async def extract_frames(self) -> tuple[int, int]:
-        process = await asyncio.create_subprocess_exec(
-            "webpmux",
-            "-info",
-            self._file_path,
-            stdout=asyncio.subprocess.PIPE,
+        data = read_source(source)
+        self.info = parse_webp(data)
+        self._data = truncate_webp(data, self.info.length)
+        self._image = Image.open(BytesIO(self._data))
+        self.size: tuple[int, int] = self._image.size
+
+    async def extract_frames(self) -> list[int]:
+        return [frame.duration for frame in self.info.frames]
+
+    def frames(
+        self, sizes: list[tuple[int, int]], keep: list[int]
+    ) -> AsyncIterator[tuple[int, list[bytes]]]:
+        stop = threading.Event()
+        return iterate_async(
+            self._loop, self.__iter_frames(sizes, keep, stop), stop
         )
-        stdout, _ = await process.communicate()
-        durations = []
-        start = False
-        duration_index = -1
-        for line in stdout.decode().splitlines():
-            if "duration" in line:
-                duration_index = line.split().index("duration")
-                start = True
-                continue
-            if not start:
-                continue
-            try:
-                durations.append(int(line.split()[duration_index]))
-            except IndexError:
-                pass
-        gcd, frames = durations_to_frames(durations)
-        return gcd, await run_function_async(self._loop, self.__extract_frames, frames)
 
     async def close(self):
         return await run_function_async(self._loop, self.__close)
 
-    def __extract_frames(self, frames: dict[int, int]) -> int:
-        file_index = 0
-        for frame_index, repeat in frames.items():
+    def __iter_frames(
+        self, sizes: list[tuple[int, int]], keep: list[int], stop: threading.Event
+    ) -> Iterator[tuple[int, list[bytes]]]:
+        for frame_index in keep:
+            if stop.is_set():
+                return
             self._image.seek(frame_index)
-            for _ in range(repeat):
-                self._image.save(f"{self._tmpdir}/{file_index:08d}.png")
-                file_index += 1
-        return file_index
+            frame = self._image.convert("RGBA")
+            yield frame_index, [resize_frame(frame, size) for size in sizes]
 
     def __close(self):
         self._image.close()
@@ -0,0 +1,197 @@
+import math
+import resource
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+FRAMES = (1, 2, 5, 10, 20, 30, 45, 60, 90, 120, 250, 500, 1000)
+BYTES = tuple(2**power for power in range(10, 25))
+
+Labels = tuple[tuple[str, str], ...]
+
+_collected: ContextVar[list[dict] | None] = ContextVar("collected", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]) -> None:
+        self.name = name
+        self._help = help
+        self._buckets = tuple(buckets) + (math.inf,)
+        self._series: dict[Labels, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted((name, str(label)) for name, label in labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self._buckets) + [0.0]
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self._help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            for bound, count in zip(self._buckets, values):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {values[-2]}")
+        return lines
+
+
+class Gauge:
+    def __init__(
+        self, name: str, help: str, function: Callable[[], float], kind: str = "gauge"
+    ) -> None:
+        self.name = name
+        self._help = help
+        self._function = function
+        self._kind = kind
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self._help}",
+            f"# TYPE {self.name} {self._kind}",
+            f"{self.name} {_format_value(self._function())}",
+        ]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Histogram | Gauge] = {}
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...]) -> Histogram:
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, help, buckets)
+        return self._metrics[name]
+
+    def gauge(
+        self, name: str, help: str, function: Callable[[], float], kind: str = "gauge"
+    ) -> Gauge:
+        self._metrics[name] = Gauge(name, help, function, kind)
+        return self._metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+def cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def max_rss(who: int) -> float:
+    return resource.getrusage(who).ru_maxrss * 1024
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "holyemotes_stage_seconds", "Wall time per pipeline stage.", SECONDS
+)
+STAGE_FRAMES = REGISTRY.histogram(
+    "holyemotes_stage_frames", "Frames handled per pipeline stage.", FRAMES
+)
+STAGE_BYTES = REGISTRY.histogram(
+    "holyemotes_stage_output_bytes", "Output bytes per pipeline stage.", BYTES
+)
+CONVERSION_PROCESS_CPU_SECONDS = REGISTRY.histogram(
+    "holyemotes_conversion_process_cpu_seconds",
+    "Process-wide CPU time, subprocesses included, that elapsed while a "
+    "conversion ran. Concurrent conversions are counted in each other's "
+    "figures.",
+    SECONDS,
+)
+REGISTRY.gauge(
+    "holyemotes_cpu_seconds_total",
+    "CPU time of this process and its reaped subprocesses.",
+    cpu_seconds,
+    "counter",
+)
+REGISTRY.gauge(
+    "holyemotes_max_rss_bytes",
+    "Peak resident set size of this process.",
+    lambda: max_rss(resource.RUSAGE_SELF),
+)
+REGISTRY.gauge(
+    "holyemotes_subprocess_max_rss_bytes",
+    "Peak resident set size of the largest reaped subprocess.",
+    lambda: max_rss(resource.RUSAGE_CHILDREN),
+)
+
+
+@contextmanager
+def collect():
+    spans = []
+    token = _collected.set(spans)
+    try:
+        yield spans
+    finally:
+        _collected.reset(token)
+
+
+class span:
+    def __init__(self, stage: str, cpu: bool = False, **labels: str) -> None:
+        self.labels = {"stage": stage, **labels}
+        self.frames: int | None = None
+        self.output_bytes: int | None = None
+        self._cpu = cpu
+        self._started = 0.0
+        self._cpu_started = 0.0
+
+    def __enter__(self) -> "span":
+        self._started = perf_counter()
+        if self._cpu:
+            self._cpu_started = cpu_seconds()
+        return self
+
+    def __exit__(self, kind, value, traceback) -> None:
+        labels = {**self.labels, "status": "error" if kind else "ok"}
+        seconds = perf_counter() - self._started
+        STAGE_SECONDS.observe(seconds, **labels)
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(
+                {
+                    **labels,
+                    "seconds": seconds,
+                    "frames": self.frames,
+                    "output_bytes": self.output_bytes,
+                }
+            )
+        if self._cpu:
+            CONVERSION_PROCESS_CPU_SECONDS.observe(
+                cpu_seconds() - self._cpu_started, **labels
+            )
+        if self.frames is not None:
+            STAGE_FRAMES.observe(self.frames, **labels)
+        if self.output_bytes is not None:
+            STAGE_BYTES.observe(self.output_bytes, **labels)
@@ -0,0 +1,94 @@
+import os
+import resource
+import signal
+from typing import NamedTuple
+
+from budget import BudgetExceededError
+
+MAX_CANVAS_PIXELS = int(os.getenv("MAX_CANVAS_PIXELS", 4096 * 4096))
+MAX_SOURCE_FRAMES = int(os.getenv("MAX_SOURCE_FRAMES", 3000))
+MAX_DECODED_PIXELS = int(os.getenv("MAX_DECODED_PIXELS", 2 * 1024**3))
+MAX_BUFFERED_BYTES = int(os.getenv("MAX_BUFFERED_BYTES", 256 * 1024 * 1024))
+DECODE_TIMEOUT = float(os.getenv("DECODE_TIMEOUT", 60))
+ENCODE_TIMEOUT = float(os.getenv("ENCODE_TIMEOUT", 60))
+ENCODER_MEMORY_LIMIT = int(os.getenv("ENCODER_MEMORY_LIMIT", 2 * 1024**3))
+ENCODER_CPU_LIMIT = int(os.getenv("ENCODER_CPU_LIMIT", 120))
+
+
+class LimitExceededError(BudgetExceededError):
+    pass
+
+
+class Probe(NamedTuple):
+    width: int
+    height: int
+    source_frames: int
+    decoded_frames: int
+    kept_frames: int
+    output_frames: int
+    decoded_pixels: int
+    buffered_bytes: int
+
+
+def probe(
+    size: tuple[int, int],
+    frames: dict[int, int],
+    keep: list[int],
+    output_sizes: list[tuple[int, int]],
+) -> Probe:
+    width, height = size
+    decoded_frames = keep[-1] + 1 if keep else 0
+    output_frames = sum(frames.values())
+    output_pixels = sum(w * h for w, h in output_sizes)
+    return Probe(
+        width=width,
+        height=height,
+        source_frames=len(frames),
+        decoded_frames=decoded_frames,
+        kept_frames=len(keep),
+        output_frames=output_frames,
+        decoded_pixels=width * height * decoded_frames,
+        buffered_bytes=len(keep) * output_pixels * 4,
+    )
+
+
+def check_canvas(size: tuple[int, int]) -> None:
+    width, height = size
+    if width * height > MAX_CANVAS_PIXELS:
+        raise LimitExceededError(
+            f"canvas {width}x{height} is over {MAX_CANVAS_PIXELS} pixels"
+        )
+
+
+def enforce(preflight: Probe) -> None:
+    check_canvas((preflight.width, preflight.height))
+    if preflight.source_frames > MAX_SOURCE_FRAMES:
+        raise LimitExceededError(
+            f"{preflight.source_frames} frames, limit is {MAX_SOURCE_FRAMES}"
+        )
+    if preflight.decoded_pixels > MAX_DECODED_PIXELS:
+        raise LimitExceededError(
+            f"decoding needs {preflight.decoded_pixels} pixels, "
+            f"limit is {MAX_DECODED_PIXELS}"
+        )
+    if preflight.buffered_bytes > MAX_BUFFERED_BYTES:
+        raise LimitExceededError(
+            f"buffering needs {preflight.buffered_bytes} bytes, "
+            f"limit is {MAX_BUFFERED_BYTES}"
+        )
+
+
+def limit_subprocess(pid: int) -> None:
+    try:
+        resource.prlimit(
+            pid, resource.RLIMIT_AS, (ENCODER_MEMORY_LIMIT, ENCODER_MEMORY_LIMIT)
+        )
+        resource.prlimit(
+            pid, resource.RLIMIT_CPU, (ENCODER_CPU_LIMIT, ENCODER_CPU_LIMIT + 5)
+        )
+    except ProcessLookupError:
+        pass
+
+
+def limit_signal(returncode: int | None) -> bool:
+    return returncode in (-signal.SIGXCPU, -signal.SIGKILL)
@@ -0,0 +1,137 @@
+import asyncio
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Awaitable, Callable, Hashable
+
+from formats.utils import set_executor
+
+INTERACTIVE = 0
+BULK = 1
+
+Job = tuple[asyncio.Future, Callable[[], Awaitable[Any]], float]
+
+
+class SchedulerBusyError(Exception):
+    pass
+
+
+class Scheduler:
+    def __init__(
+        self,
+        slots: int | None = None,
+        max_queue: int = 256,
+        max_per_user: int = 64,
+        max_wait: float = 120.0,
+    ) -> None:
+        self._slots = slots or os.cpu_count() or 1
+        self._max_queue = max_queue
+        self._max_per_user = max_per_user
+        self._max_wait = max_wait
+        self._queues: list[dict[Hashable, deque[Job]]] = [{}, {}]
+        self._per_user: dict[Hashable, int] = {}
+        self._queued = [0, 0]
+        self._pending = asyncio.Semaphore(0)
+        self._space = asyncio.Condition()
+        self._workers: list[asyncio.Task] = []
+        self._executor: ThreadPoolExecutor | None = None
+        self.rejected = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(self._queued)
+
+    def start(self) -> None:
+        self._executor = ThreadPoolExecutor(self._slots, "convert")
+        set_executor(self._executor)
+        self._workers = [
+            asyncio.create_task(self.__worker()) for _ in range(self._slots)
+        ]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        set_executor(None)
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        user_id: Hashable,
+        priority: int = BULK,
+    ) -> Any:
+        if priority == INTERACTIVE:
+            if self._queued[INTERACTIVE] >= self._max_queue:
+                self.rejected += 1
+                raise SchedulerBusyError(
+                    f"queue is full ({self._queued[INTERACTIVE]} jobs)"
+                )
+            if self._per_user.get(user_id, 0) >= self._max_per_user:
+                self.rejected += 1
+                raise SchedulerBusyError(f"too many queued jobs for {user_id}")
+            deadline = monotonic() + self._max_wait
+        else:
+            async with self._space:
+                await self._space.wait_for(lambda: self.__has_space(user_id))
+            deadline = math.inf
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user_id, deque()).append(
+            (future, factory, deadline)
+        )
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        self._queued[priority] += 1
+        self._pending.release()
+        return await future
+
+    def __has_space(self, user_id: Hashable) -> bool:
+        return (
+            self._queued[BULK] < self._max_queue
+            and self._per_user.get(user_id, 0) < self._max_per_user
+        )
+
+    def __pop(self) -> Job:
+        for priority, queue in enumerate(self._queues):
+            if not queue:
+                continue
+            user_id, jobs = next(iter(queue.items()))
+            job = jobs.popleft()
+            del queue[user_id]
+            if jobs:
+                queue[user_id] = jobs
+            self._per_user[user_id] -= 1
+            if not self._per_user[user_id]:
+                del self._per_user[user_id]
+            self._queued[priority] -= 1
+            return job
+        raise LookupError("scheduler queue is empty")
+
+    async def __worker(self) -> None:
+        while True:
+            await self._pending.acquire()
+            future, factory, deadline = self.__pop()
+            async with self._space:
+                self._space.notify_all()
+            if future.done():
+                continue
+            if monotonic() > deadline:
+                self.rejected += 1
+                future.set_exception(
+                    SchedulerBusyError(
+                        f"job waited over {self._max_wait:.1f}s in queue"
+                    )
+                )
+                continue
+            try:
+                result = await factory()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,43 @@
+from io import BytesIO
+
+from PIL import Image
+
+from budget import BudgetExceededError
+from formats.utils import resize_image
+
+METHOD = 4
+LOSSY_START = 90
+
+
+def _save(image: Image.Image, **options) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, "WEBP", method=METHOD, **options)
+    return buffer.getvalue()
+
+
+def encode_static(
+    image: Image.Image, size: tuple[int, int], max_size: int
+) -> tuple[bytes, int]:
+    image = resize_image(image, size)
+    content = _save(image, lossless=True)
+    attempts = 1
+    if len(content) <= max_size:
+        return content, attempts
+    content = _save(image, quality=LOSSY_START)
+    attempts += 1
+    if len(content) <= max_size:
+        return content, attempts
+    low, high, best = 1, LOSSY_START - 1, None
+    while low <= high:
+        quality = (low + high + 1) // 2
+        content = _save(image, quality=quality)
+        attempts += 1
+        if len(content) <= max_size:
+            best, low = content, quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        raise BudgetExceededError(
+            f"static output is over {max_size} bytes after {attempts} attempts"
+        )
+    return best, attempts
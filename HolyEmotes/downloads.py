@@ -0,0 +1,77 @@
+import hashlib
+from collections import OrderedDict
+
+import aiohttp
+
+from cache import ConversionCache
+
+
+class DownloadTooLargeError(Exception):
+    pass
+
+
+def create_session(
+    limit: int = 64, limit_per_host: int = 8, keepalive: float = 60.0
+) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        keepalive_timeout=keepalive,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(total=60, sock_connect=10, sock_read=30)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+class Downloader:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        cache: ConversionCache,
+        max_size: int,
+        max_validators: int = 16384,
+    ) -> None:
+        self._session = session
+        self._cache = cache
+        self._max_size = max_size
+        self._max_validators = max_validators
+        self._validators: OrderedDict[str, dict[str, str]] = OrderedDict()
+        self.revalidated = 0
+
+    async def fetch(self, url: str) -> bytes:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        headers = self._validators.get(key, {})
+        cached = await self._cache.get(key) if headers else None
+        async with self._session.get(
+            url, headers=headers if cached else None
+        ) as response:
+            if response.status == 304 and cached:
+                self.revalidated += 1
+                self._validators.move_to_end(key)
+                return cached[0]
+            response.raise_for_status()
+            if (response.content_length or 0) > self._max_size:
+                raise DownloadTooLargeError(f"{url} is {response.content_length} bytes")
+            content = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                content += chunk
+                if len(content) > self._max_size:
+                    raise DownloadTooLargeError(f"{url} is over {self._max_size} bytes")
+            content = bytes(content)
+            self.__remember(key, response.headers)
+        if key in self._validators:
+            await self._cache.put(key, content, "bin")
+        return content
+
+    def __remember(self, key: str, headers) -> None:
+        validators = {}
+        if "ETag" in headers:
+            validators["If-None-Match"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            validators["If-Modified-Since"] = headers["Last-Modified"]
+        self._validators.pop(key, None)
+        if not validators:
+            return
+        self._validators[key] = validators
+        while len(self._validators) > self._max_validators:
+            self._validators.popitem(last=False)
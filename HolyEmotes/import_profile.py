@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODULES = ["temp_bot", "worker", "convert"]
+ENVIRONMENT = {
+    "TOKEN": "0000000000:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA",
+    "MONGODB": "mongodb://127.0.0.1:27017/",
+}
+
+
+class ImportFailedError(Exception):
+    pass
+
+
+def profile(module: str) -> list[tuple[str, int, int, int]]:
+    environment = {**ENVIRONMENT, **os.environ}
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [ROOT, os.path.join(ROOT, "converter"), environment.get("PYTHONPATH", "")]
+    )
+    try:
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT,
+            env=environment,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stderr
+    except subprocess.CalledProcessError as e:
+        lines = [
+            line
+            for line in e.stderr.splitlines()
+            if not line.startswith("import time:")
+        ]
+        raise ImportFailedError(lines[-1] if lines else f"exit code {e.returncode}")
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(own), int(cumulative), depth))
+    return imports
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json")
+    parser.add_argument("--max-ms", type=float)
+    args = parser.parse_args()
+
+    report = {}
+    failed = []
+    for module in args.modules:
+        try:
+            imports = profile(module)
+        except ImportFailedError as e:
+            print(f"{module}: import failed: {e}")
+            report[module] = {"error": str(e)}
+            failed.append(module)
+            continue
+        total = sum(own for _, own, _, _ in imports) / 1000
+        heaviest = sorted(imports, key=lambda entry: entry[2], reverse=True)
+        top_level = [entry for entry in heaviest if entry[3] <= 1][: args.top]
+        report[module] = {
+            "total_ms": total,
+            "top": {name: cumulative / 1000 for name, _, cumulative, _ in top_level},
+        }
+        print(f"{module}: {total:.1f} ms")
+        for name, _, cumulative, _ in top_level:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.max_ms is not None:
+        slow = [
+            m
+            for m, result in report.items()
+            if result.get("total_ms", 0) > args.max_ms
+        ]
+        for module in slow:
+            print(
+                f"{module} imports in {report[module]['total_ms']:.1f} ms, "
+                f"limit is {args.max_ms} ms"
+            )
+        return 1 if slow or failed else 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+NGRAM = 3
+
+
+class CodeIndex:
+    def __init__(self, stickers: list[dict]) -> None:
+        self._codes = [sticker["code"].lower() for sticker in stickers]
+        self._sorted = sorted((code, i) for i, code in enumerate(self._codes))
+        self._ngrams: dict[str, set[int]] = defaultdict(set)
+        for i, code in enumerate(self._codes):
+            for start in range(len(code) - NGRAM + 1):
+                self._ngrams[code[start : start + NGRAM]].add(i)
+
+    def search(self, query: str) -> list[int]:
+        query = query.lower()
+        prefix = self.__prefix(query)
+        seen = set(prefix)
+        return prefix + [i for i in self.__substring(query) if i not in seen]
+
+    def __prefix(self, query: str) -> list[int]:
+        start = bisect_left(self._sorted, (query, -1))
+        matches = []
+        for code, i in self._sorted[start:]:
+            if not code.startswith(query):
+                break
+            matches.append(i)
+        return sorted(matches, key=lambda i: (len(self._codes[i]), i))
+
+    def __substring(self, query: str) -> list[int]:
+        if len(query) < NGRAM:
+            candidates = range(len(self._codes))
+        else:
+            postings = [
+                self._ngrams.get(query[start : start + NGRAM], set())
+                for start in range(len(query) - NGRAM + 1)
+            ]
+            candidates = sorted(set.intersection(*postings))
+        return [i for i in candidates if query in self._codes[i]]
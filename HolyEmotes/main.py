@@ -1,15 +1,36 @@
-import traceback
+import os
+from functools import partial
 
 from fastapi import FastAPI, Request
 from fastapi.responses import RedirectResponse, Response, PlainTextResponse
 from aiogram.types.update import Update
 
 from bot import SECRET, startup, shutdown, bot, dp
+from metrics import REGISTRY, span
+from update_queue import UpdateQueue
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 8))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 1000))
+
+updates = UpdateQueue(
+    partial(dp.feed_update, bot), UPDATE_WORKERS, UPDATE_QUEUE_SIZE
+)
+REGISTRY.gauge(
+    "holyemotes_update_queue_depth", "Updates waiting for a worker.", lambda: updates.depth
+)
+REGISTRY.gauge(
+    "holyemotes_updates_dropped_total",
+    "Updates rejected because the queue was full.",
+    lambda: updates.overflows,
+    "counter",
+)
 
 
 async def lifespan(app: FastAPI):
     await startup()
+    updates.start()
     yield
+    await updates.stop()
     await shutdown()
 
 
@@ -23,15 +44,23 @@ async def page(request: Request):
 
 @app.post("/webhook")
 async def webhook(request: Request):
-    assert request.headers.get("X-Telegram-Bot-Api-Secret-Token", "") == SECRET
-    update = Update.model_validate(await request.json(), context={"bot": bot})
-    try:
-        await dp.feed_update(bot, update)
-    except Exception:
-        print(traceback.format_exc())
+    if request.headers.get("X-Telegram-Bot-Api-Secret-Token", "") != SECRET:
+        return Response(status_code=403)
+    with span("webhook"):
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+        accepted = updates.put(update)
+    if not accepted:
+        return Response(status_code=503)
     return Response()
 
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.get("/")
 async def index():
     return RedirectResponse("https://t.me/HolyStickersBot", status_code=301)
@@ -0,0 +1,41 @@
+import heapq
+from time import monotonic
+from typing import Any, Hashable
+
+
+class Popularity:
+    def __init__(self, half_life: float = 24 * 3600, max_entries: int = 4096) -> None:
+        self._half_life = half_life
+        self._max_entries = max_entries
+        self._scores: dict[Hashable, tuple[float, float]] = {}
+        self._values: dict[Hashable, Any] = {}
+
+    def record(self, key: Hashable, value: Any = None, weight: float = 1.0) -> None:
+        now = monotonic()
+        self._scores[key] = (self.__score(key, now) + weight, now)
+        if value is not None:
+            self._values[key] = value
+        if len(self._scores) > self._max_entries * 2:
+            self.__trim(now)
+
+    def top(self, count: int) -> list[tuple[Hashable, Any]]:
+        now = monotonic()
+        keys = heapq.nlargest(
+            count, self._scores, key=lambda key: self.__score(key, now)
+        )
+        return [(key, self._values.get(key)) for key in keys]
+
+    def __score(self, key: Hashable, now: float) -> float:
+        score, updated = self._scores.get(key, (0.0, now))
+        return score * 0.5 ** ((now - updated) / self._half_life)
+
+    def __trim(self, now: float) -> None:
+        keep = set(
+            heapq.nlargest(
+                self._max_entries, self._scores, key=lambda key: self.__score(key, now)
+            )
+        )
+        for key in list(self._scores):
+            if key not in keep:
+                del self._scores[key]
+                self._values.pop(key, None)
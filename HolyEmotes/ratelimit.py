@@ -0,0 +1,50 @@
+import asyncio
+from time import monotonic
+from typing import Awaitable, Callable, TypeVar
+
+from aiogram.exceptions import TelegramRetryAfter
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self._capacity, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+        self._tokens = 0.0
+
+
+async def limited(
+    bucket: TokenBucket, function: Callable[[], Awaitable[T]], retries: int = 5
+) -> T:
+    for _ in range(retries):
+        await bucket.acquire()
+        try:
+            return await function()
+        except TelegramRetryAfter as e:
+            bucket.pause(e.retry_after)
+    await bucket.acquire()
+    return await function()
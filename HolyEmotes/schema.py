@@ -0,0 +1,79 @@
+from typing import NamedTuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+DUPLICATE_KEY = 11000
+
+
+class Index(NamedTuple):
+    keys: list[tuple[str, int]]
+    options: dict
+
+
+INDEXES = {
+    "stickers": [
+        Index([("sticker_id", 1), ("sticker_type", 1)], {"unique": True}),
+        Index([("source_hash", 1), ("sticker_type", 1)], {}),
+        Index([("file_unique_id", 1), ("sticker_type", 1)], {}),
+    ],
+    "sticker_sets": [
+        Index([("name", 1)], {"unique": True}),
+        Index([("owner_id", 1), ("channel", 1), ("sticker_type", 1)], {}),
+    ],
+    "cache": [
+        Index([("expires", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "build_jobs": [
+        Index([("status", 1)], {}),
+        Index([("owner_id", 1), ("channel", 1), ("sticker_type", 1)], {}),
+        Index([("expires", 1)], {"expireAfterSeconds": 0}),
+    ],
+}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase) -> None:
+    for name, indexes in INDEXES.items():
+        collection = db[name]
+        existing = {
+            tuple(tuple(key) for key in info["key"]): (index_name, info)
+            for index_name, info in (await collection.index_information()).items()
+        }
+        for index in indexes:
+            found = existing.get(tuple(index.keys))
+            if found and all(
+                found[1].get(option) == value for option, value in index.options.items()
+            ):
+                continue
+            if found:
+                await collection.drop_index(found[0])
+            await create_index(collection, index)
+
+
+async def create_index(collection: AsyncIOMotorCollection, index: Index) -> None:
+    try:
+        await collection.create_index(index.keys, **index.options)
+    except (DuplicateKeyError, OperationFailure) as e:
+        if e.code != DUPLICATE_KEY or not index.options.get("unique"):
+            raise
+        await remove_duplicates(collection, [field for field, _ in index.keys])
+        await collection.create_index(index.keys, **index.options)
+
+
+async def remove_duplicates(collection: AsyncIOMotorCollection, fields: list[str]) -> None:
+    duplicates = collection.aggregate(
+        [
+            {"$sort": {"_id": 1}},
+            {
+                "$group": {
+                    "_id": {field: f"${field}" for field in fields},
+                    "ids": {"$push": "$_id"},
+                    "count": {"$sum": 1},
+                }
+            },
+            {"$match": {"count": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+    async for group in duplicates:
+        await collection.delete_many({"_id": {"$in": group["ids"][:-1]}})
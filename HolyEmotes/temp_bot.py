@@ -1,18 +1,19 @@
 import asyncio
+import hashlib
 import os
 import math
+import traceback
+from collections import OrderedDict
+from functools import partial
+from datetime import datetime, timedelta, timezone
 from time import time
-from typing import Literal
-from uuid import uuid4
-import json
+from typing import Awaitable, Callable, Literal, NamedTuple
 
 import aiohttp
-import emoji
-import emoji.tokenizer
 from aiogram import Bot, Dispatcher, html
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from aiogram.filters import CommandStart, Command
 from aiogram.types import (
     Message,
@@ -30,8 +31,26 @@ from aiogram.fsm.storage.mongo import MongoStorage
 from aiogram.fsm.state import State, StatesGroup
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne
 
+from budget import BudgetExceededError
+from build_jobs import DONE, FAILED, BuildJournal
+from cache import ConversionCache, cache_key, source_hash
+from channel_cache import ChannelCache
+from conversion_queue import (
+    ConversionFailedError,
+    ConversionQueue,
+    ConversionTimeoutError,
+)
 from convert import Converter
+from downloads import Downloader, DownloadTooLargeError, create_session
+from encoders import EncoderError
+from inline_search import CodeIndex
+from metrics import span
+from popularity import Popularity
+from ratelimit import TokenBucket, limited
+from scheduler import BULK, INTERACTIVE, Scheduler, SchedulerBusyError
+from schema import ensure_indexes
 
 load_dotenv()
 
@@ -40,19 +59,79 @@ MONGODB = os.getenv("MONGODB")
 WEBHOOK = os.getenv("WEBHOOK")
 SECRET = os.getenv("SECRET")
 
+PREPARE_CONCURRENCY = 8
+INITIAL_STICKERS = 50
+TELEGRAM_RATE = 5
+TELEGRAM_BURST = 10
+CACHE_TTL = 3600
+STICKER_TYPES = ["regular", "custom_emoji"]
+MAX_STICKERS = {"regular": 120, "custom_emoji": 200}
+SYNC_INTERVAL = int(os.getenv("SYNC_INTERVAL", 6 * 3600))
+STATUS_INTERVAL = 3
+SET_WRITE_BATCH = 20
+ACCOUNT_TTL = 24 * 3600
+ALLOWED_UPDATES = [
+    "message",
+    "inline_query",
+    "chosen_inline_result",
+    "callback_query",
+]
+WARM_INTERVAL = int(os.getenv("WARM_INTERVAL", 300))
+WARM_CONVERSIONS = int(os.getenv("WARM_CONVERSIONS", 50))
+WARM_TELEGRAM_RATE = float(os.getenv("WARM_TELEGRAM_RATE", 0.5))
+WARM_UPLOADER_ID = int(os.getenv("WARM_UPLOADER_ID") or 0)
+WARM_CHANNELS = 20
+WARM_EMOTES = 200
+GLOBAL_CHANNEL = "__global__"
+DUAL_RENDITIONS = os.getenv("DUAL_RENDITIONS", "0") == "1"
+CONVERSION_CACHE_DIR = os.getenv("CONVERSION_CACHE_DIR", "/tmp/holyemotes")
+CONVERSION_CACHE_SIZE = int(os.getenv("CONVERSION_CACHE_SIZE", 1024 * 1024 * 1024))
+DOWNLOAD_CACHE_DIR = os.getenv("DOWNLOAD_CACHE_DIR", "/tmp/holyemotes-downloads")
+DOWNLOAD_CACHE_SIZE = int(os.getenv("DOWNLOAD_CACHE_SIZE", 512 * 1024 * 1024))
+MAX_DOWNLOAD_SIZE = 16 * 1024 * 1024
+CONVERSION_QUEUE = os.getenv("CONVERSION_QUEUE", "0") == "1"
+MAX_QUEUED_SOURCE = 8 * 1024 * 1024
+NEGATIVE_CACHE_TTL = 300
+INLINE_CACHE_TTL = 30
+INLINE_PAGE_SIZE = 50
+CODE_INDEX_SIZE = 256
+
 client = AsyncIOMotorClient(MONGODB)
 db = client.HolyStickers
-converter = Converter()
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher(storage=MongoStorage(client, db_name="HolyStickers"))
+scheduler = Scheduler()
+telegram_bucket = TokenBucket(TELEGRAM_RATE, TELEGRAM_BURST)
+warm_bucket = TokenBucket(WARM_TELEGRAM_RATE, 1)
+channel_popularity = Popularity()
+emote_popularity = Popularity(max_entries=16384)
+channel_cache = ChannelCache(negative=lambda value: isinstance(value, str))
+build_journal = BuildJournal(db.build_jobs)
+conversion_queue = ConversionQueue(db.conversion_jobs)
+inline_cache = ChannelCache(max_entries=4096, stale=0)
+code_indexes: OrderedDict[str, tuple[list[dict], CodeIndex]] = OrderedDict()
 session: aiohttp.ClientSession = None
 bot_account: User = None
+conversion_cache: ConversionCache = None
+downloader: Downloader = None
+sync_task: asyncio.Task = None
+warm_task: asyncio.Task = None
+syncing: set[tuple[int, str, str]] = set()
+build_tasks: set[asyncio.Task] = set()
+command_tasks: set[asyncio.Task] = set()
 
 
 class NewStickerSet(StatesGroup):
     pass
 
 
+class SyncResult(NamedTuple):
+    added: int
+    removed: int
+    replaced: int
+    created: list[str]
+
+
 def extract_id(url: str):
     if "jtvnw.net" in url:
         return url.split("/emoticons/v2/")[-1].split("/")[0]
@@ -60,85 +139,804 @@ def extract_id(url: str):
         return url.split("emote/")[-1].split("/")[0]
 
 
-async def download_sticker(url: str, sticker_type: Literal["regular", "custom_emoji"]):
-    response = await session.get(url)
-    content = await response.read()
-    with open("/tmp/emoji", "wb") as f:
-        f.write(content)
-    return await converter.convert("/tmp/emoji", sticker_type)
+async def download_sticker(url: str) -> bytes:
+    with span("download") as download:
+        content = await downloader.fetch(url)
+        download.output_bytes = len(content)
+    return content
+
+
+async def convert_sticker(
+    content: bytes,
+    content_hash: str,
+    sticker_types: list[Literal["regular", "custom_emoji"]],
+    user_id: int,
+    priority: int = BULK,
+) -> tuple[dict[str, tuple[bytes, str]], dict[str, Exception]]:
+    results = {}
+    for sticker_type in sticker_types:
+        cached = await conversion_cache.get(cache_key(content_hash, sticker_type))
+        if cached:
+            results[sticker_type] = cached
+    missing = [t for t in sticker_types if t not in results]
+    if not missing:
+        return results, {}
+    if CONVERSION_QUEUE and len(content) <= MAX_QUEUED_SOURCE:
+        converted, errors = await conversion_queue.submit(
+            content, content_hash, missing, priority
+        )
+    else:
+        converter = Converter(asyncio.get_running_loop(), content, missing[0])
+        converted = await scheduler.submit(
+            partial(converter.convert_renditions, missing), user_id, priority
+        )
+        errors = converter.errors
+    for sticker_type, (converted_content, ext) in converted.items():
+        await conversion_cache.put(
+            cache_key(content_hash, sticker_type), converted_content, ext
+        )
+    results.update(converted)
+    return results, errors
+
+
+async def upload_rendition(
+    sticker_id: str,
+    user_id: int,
+    sticker_type: Literal["regular", "custom_emoji"],
+    content: bytes,
+    ext: str,
+) -> dict:
+    format = "video" if ext == "webm" else "static"
+    with span("telegram_upload", sticker_type=sticker_type) as upload:
+        upload.output_bytes = len(content)
+        file = await limited(
+            telegram_bucket,
+            partial(
+                bot.upload_sticker_file,
+                user_id,
+                BufferedInputFile(
+                    content,
+                    filename=f"{sticker_id}.{ext}",
+                ),
+                format,
+            ),
+        )
+    return {
+        "sticker_type": sticker_type,
+        "sticker_id": sticker_id,
+        "file_id": file.file_id,
+        "file_unique_id": file.file_unique_id,
+        "filename": f"{sticker_id}.{ext}",
+        "format": format,
+    }
 
 
 async def upload_sticker(
     sticker: dict,
-    user_id: str,
+    user_id: int,
     sticker_type: Literal["regular", "custom_emoji"],
     force: bool = False,
+    priority: int = BULK,
+    progress: Callable[..., Awaitable[None]] | None = None,
 ):
     url = sticker["urls"][-1]["url"]
     sticker_id = extract_id(url)
-    sticker_document = await db.stickers.find_one(
-        {"sticker_id": sticker_id, "sticker_type": sticker_type}
-    )
-    if force or not sticker_document:
-        if force and sticker_document:
-            await db.stickers.delete_one({"_id": sticker_document["_id"]})
-        content, ext = await download_sticker(url, sticker_type)
-        with open(f"/tmp/{sticker_id}.{ext}", "wb") as f:
-            f.write(content)
-        format = "video" if ext == "webm" else "static"
-        file = await bot.upload_sticker_file(
-            user_id,
-            BufferedInputFile(
-                content,
-                filename=f"{sticker_id}.{ext}",
-            ),
-            format,
+    sticker_types = STICKER_TYPES if DUAL_RENDITIONS else [sticker_type]
+    documents = {
+        document["sticker_type"]: document
+        async for document in db.stickers.find(
+            {"sticker_id": sticker_id, "sticker_type": {"$in": sticker_types}},
+            {"_id": 0},
         )
-
-        sticker_document = {
-            "sticker_type": sticker_type,
-            "sticker_id": sticker_id,
-            "file_id": file.file_id,
-            "file_unique_id": file.file_unique_id,
-            "filename": f"{sticker_id}.{ext}",
-            "format": format,
-        }
-
-        await db.stickers.insert_one(sticker_document)
-    return InputSticker(
+    }
+    missing = [
+        t
+        for t in sticker_types
+        if t not in documents or (force and t == sticker_type)
+    ]
+    if sticker_type in missing:
+        source = await download_sticker(url)
+        content_hash = source_hash(source)
+        if progress:
+            await progress("downloaded", source_hash=content_hash)
+        uploaded = []
+        if not force:
+            async for document in db.stickers.find(
+                {"source_hash": content_hash, "sticker_type": {"$in": missing}},
+                {"_id": 0},
+            ):
+                if document["sticker_type"] not in missing:
+                    continue
+                missing.remove(document["sticker_type"])
+                ext = document["filename"].rsplit(".", 1)[-1]
+                uploaded.append(
+                    {**document, "sticker_id": sticker_id, "filename": f"{sticker_id}.{ext}"}
+                )
+        if missing:
+            results, errors = await convert_sticker(
+                source, content_hash, missing, user_id, priority
+            )
+            if sticker_type in errors:
+                raise errors[sticker_type]
+        if progress:
+            await progress("converted")
+        if missing:
+            uploaded += await asyncio.gather(
+                *(
+                    upload_rendition(sticker_id, user_id, t, content, ext)
+                    for t, (content, ext) in results.items()
+                )
+            )
+        for document in uploaded:
+            document["source_hash"] = content_hash
+        if uploaded:
+            await db.stickers.bulk_write(
+                [
+                    ReplaceOne(
+                        {"sticker_id": sticker_id, "sticker_type": d["sticker_type"]},
+                        d,
+                        upsert=True,
+                    )
+                    for d in uploaded
+                ],
+                ordered=False,
+            )
+        documents.update((document["sticker_type"], document) for document in uploaded)
+    sticker_document = documents[sticker_type]
+    input_sticker = InputSticker(
         sticker=sticker_document["file_id"],
         format=sticker_document["format"],
         emoji_list=["🪱"],
         keywords=[sticker["code"]],
     )
+    return input_sticker, sticker_document
+
+
+async def add_sticker_to_set(sticker: InputSticker, user_id: int, set_name: str):
+    with span("add_to_set"):
+        await limited(
+            telegram_bucket,
+            partial(bot.add_sticker_to_set, user_id, set_name, sticker),
+        )
 
 
-async def add_sticker_to_set(
+async def prepare_sticker(
     sticker: dict,
     user_id: int,
-    set_name: str,
     sticker_type: Literal["regular", "custom_emoji"],
-):
-    await bot.add_sticker_to_set(
-        user_id, set_name, await upload_sticker(sticker, user_id, sticker_type)
+    semaphore: asyncio.Semaphore,
+    priority: int = BULK,
+    force: bool = False,
+    progress: Callable[..., Awaitable[None]] | None = None,
+) -> tuple[str, InputSticker, dict] | None:
+    async with semaphore:
+        try:
+            input_sticker, document = await upload_sticker(
+                sticker, user_id, sticker_type, force, priority, progress
+            )
+            return document["sticker_id"], input_sticker, document
+        except (
+            BudgetExceededError,
+            ConversionFailedError,
+            ConversionTimeoutError,
+            DownloadTooLargeError,
+            EncoderError,
+            aiohttp.ClientError,
+            SchedulerBusyError,
+            TelegramBadRequest,
+        ):
+            return None
+        except Exception:
+            print(traceback.format_exc())
+            return None
+
+
+def set_member(document: dict) -> dict:
+    return {
+        "file_id": document["file_id"],
+        "file_unique_id": document["file_unique_id"],
+        "source_hash": document.get("source_hash"),
+    }
+
+
+def sticker_set_name(
+    channel: str, sticker_type: Literal["regular", "custom_emoji"], index: int
+) -> str:
+    suffix = f"_{index + 1}" if index else ""
+    return f"{channel}_{sticker_type}{suffix}_by_{bot_account.username}"
+
+
+def sticker_set_title(channel: str, index: int) -> str:
+    title = f"Twitch {channel} by @{bot_account.username}"
+    if index:
+        title += f" ({index + 1})"
+    return title
+
+
+async def build_sticker_set(
+    user_id: int,
+    channel: str,
+    index: int,
+    sticker_type: Literal["regular", "custom_emoji"],
+    tasks: list[asyncio.Task],
+    on_added: Callable[[str, list[str]], Awaitable[None]] | None = None,
+    created: bool = False,
+) -> str | None:
+    name = sticker_set_name(channel, sticker_type, index)
+    pending = iter(tasks)
+    if not created:
+        initial = []
+        for task in pending:
+            prepared = await task
+            if prepared:
+                initial.append(prepared)
+            if len(initial) == INITIAL_STICKERS:
+                break
+        if not initial:
+            return None
+        with span("create_set", sticker_type=sticker_type):
+            await limited(
+                telegram_bucket,
+                partial(
+                    bot.create_new_sticker_set,
+                    user_id,
+                    name,
+                    sticker_set_title(channel, index),
+                    stickers=[input_sticker for _, input_sticker, _ in initial],
+                    sticker_type=sticker_type,
+                ),
+            )
+        await record_set_members(
+            user_id,
+            channel,
+            sticker_type,
+            index,
+            {sticker_id: document for sticker_id, _, document in initial},
+        )
+        if on_added:
+            await on_added(name, [sticker_id for sticker_id, _, _ in initial])
+    added = {}
+    try:
+        for task in pending:
+            prepared = await task
+            if not prepared:
+                continue
+            sticker_id, input_sticker, document = prepared
+            try:
+                await add_sticker_to_set(input_sticker, user_id, name)
+            except TelegramBadRequest:
+                continue
+            added[sticker_id] = document
+            if on_added:
+                await on_added(name, [sticker_id])
+            if len(added) >= SET_WRITE_BATCH:
+                await flush_set_members(user_id, channel, sticker_type, index, added)
+    finally:
+        if added:
+            await flush_set_members(user_id, channel, sticker_type, index, added)
+    return name
+
+
+async def flush_set_members(
+    user_id: int,
+    channel: str,
+    sticker_type: Literal["regular", "custom_emoji"],
+    index: int,
+    added: dict[str, dict],
+) -> None:
+    documents = dict(added)
+    added.clear()
+    await record_set_members(user_id, channel, sticker_type, index, documents)
+
+
+async def record_set_members(
+    user_id: int,
+    channel: str,
+    sticker_type: Literal["regular", "custom_emoji"],
+    index: int,
+    documents: dict[str, dict],
+) -> None:
+    fields = {
+        "owner_id": user_id,
+        "channel": channel,
+        "sticker_type": sticker_type,
+        "index": index,
+    }
+    update = {"$setOnInsert": fields}
+    if documents:
+        update["$set"] = {
+            f"stickers.{sticker_id}": set_member(document)
+            for sticker_id, document in documents.items()
+        }
+    else:
+        fields["stickers"] = {}
+    await db.sticker_sets.update_one(
+        {"name": sticker_set_name(channel, sticker_type, index)}, update, upsert=True
     )
 
 
-async def get_sticker_list(channel: str):
-    cached = await db.cache.find_one({"_id": channel})
-    if cached and time() < cached["expires"]:
-        return cached["stickers"]
-    response = await session.get(
-        f"https://emotes.adamcy.pl/v1/channel/{channel}/emotes/all"
+async def fetch_sticker_list(channel: str) -> tuple[list[dict] | str, float]:
+    cached = await db.cache.find_one({"_id": channel}, {"stickers": 1, "expires": 1})
+    if cached and isinstance(cached["expires"], datetime):
+        remaining = cached["expires"].replace(tzinfo=timezone.utc) - datetime.now(
+            timezone.utc
+        )
+        if remaining.total_seconds() > 0:
+            return cached["stickers"], remaining.total_seconds()
+    return await request_sticker_list(channel)
+
+
+async def request_sticker_list(channel: str) -> tuple[list[dict] | str, float]:
+    url = (
+        "https://emotes.adamcy.pl/v1/global/emotes/all"
+        if channel == GLOBAL_CHANNEL
+        else f"https://emotes.adamcy.pl/v1/channel/{channel}/emotes/all"
     )
-    stickers: list[dict] = await response.json()
+    with span("emote_list"):
+        response = await session.get(url)
+        stickers: list[dict] = await response.json()
     if "error" in stickers:
-        return "Такого канала нету."
+        return "Такого канала нету.", NEGATIVE_CACHE_TTL
     elif len(stickers) == 0:
-        return "На этом канале нету смайликов."
-    document = {"_id": channel, "expires": time() + 3600, "stickers": stickers}
-    await db.cache.update_one({"_id": channel}, {"$set": document}, True)
-    return stickers
+        return "На этом канале нету смайликов.", NEGATIVE_CACHE_TTL
+    expires = datetime.now(timezone.utc) + timedelta(seconds=CACHE_TTL)
+    document = {"_id": channel, "expires": expires, "stickers": stickers}
+    await db.cache.replace_one({"_id": channel}, document, upsert=True)
+    return stickers, CACHE_TTL
+
+
+async def get_sticker_list(channel: str) -> list[dict] | str:
+    return await channel_cache.get(channel, partial(fetch_sticker_list, channel))
+
+
+async def get_set_file_ids(name: str) -> dict[str, str]:
+    sticker_set = await limited(telegram_bucket, partial(bot.get_sticker_set, name))
+    return {sticker.file_unique_id: sticker.file_id for sticker in sticker_set.stickers}
+
+
+async def load_set_members(sticker_set: dict, file_ids: dict[str, str]) -> dict:
+    if "stickers" in sticker_set:
+        return sticker_set["stickers"]
+    members = {}
+    async for document in db.stickers.find(
+        {
+            "sticker_type": sticker_set["sticker_type"],
+            "file_unique_id": {"$in": list(file_ids)},
+        },
+        {"_id": 0, "sticker_id": 1, "file_id": 1, "file_unique_id": 1, "source_hash": 1},
+    ):
+        members[document["sticker_id"]] = set_member(document)
+    await db.sticker_sets.update_one(
+        {"_id": sticker_set["_id"]}, {"$set": {"stickers": members}}
+    )
+    return members
+
+
+async def source_changed(
+    sticker: dict, sticker_set: dict, sticker_id: str, semaphore: asyncio.Semaphore
+) -> bool:
+    member = sticker_set["stickers"][sticker_id]
+    async with semaphore:
+        try:
+            content = await download_sticker(sticker["urls"][-1]["url"])
+        except (DownloadTooLargeError, aiohttp.ClientError):
+            return False
+    content_hash = source_hash(content)
+    if member.get("source_hash") is None:
+        member["source_hash"] = content_hash
+        await db.sticker_sets.update_one(
+            {"_id": sticker_set["_id"]},
+            {"$set": {f"stickers.{sticker_id}.source_hash": content_hash}},
+        )
+        return False
+    return member["source_hash"] != content_hash
+
+
+async def remove_set_member(
+    sticker_set: dict, sticker_id: str, file_ids: dict[str, str]
+) -> None:
+    member = sticker_set["stickers"].pop(sticker_id)
+    file_id = file_ids.get(member["file_unique_id"])
+    if file_id:
+        try:
+            await limited(
+                telegram_bucket, partial(bot.delete_sticker_from_set, file_id)
+            )
+        except TelegramBadRequest:
+            pass
+    await db.sticker_sets.update_one(
+        {"_id": sticker_set["_id"]}, {"$unset": {f"stickers.{sticker_id}": ""}}
+    )
+
+
+async def replace_set_member(
+    sticker_set: dict,
+    user_id: int,
+    prepared: tuple[str, InputSticker, dict],
+    file_ids: dict[str, str],
+) -> bool:
+    sticker_id, input_sticker, document = prepared
+    old_sticker = file_ids.get(sticker_set["stickers"][sticker_id]["file_unique_id"])
+    if not old_sticker:
+        return False
+    try:
+        await limited(
+            telegram_bucket,
+            partial(
+                bot.replace_sticker_in_set,
+                user_id,
+                sticker_set["name"],
+                old_sticker,
+                input_sticker,
+            ),
+        )
+    except TelegramBadRequest:
+        return False
+    sticker_set["stickers"][sticker_id] = set_member(document)
+    await db.sticker_sets.update_one(
+        {"_id": sticker_set["_id"]},
+        {"$set": {f"stickers.{sticker_id}": set_member(document)}},
+    )
+    return True
+
+
+async def add_set_member(
+    sticker_set: dict, user_id: int, prepared: tuple[str, InputSticker, dict]
+) -> bool:
+    sticker_id, input_sticker, document = prepared
+    try:
+        await add_sticker_to_set(input_sticker, user_id, sticker_set["name"])
+    except TelegramBadRequest:
+        return False
+    sticker_set["stickers"][sticker_id] = set_member(document)
+    await db.sticker_sets.update_one(
+        {"_id": sticker_set["_id"]},
+        {"$set": {f"stickers.{sticker_id}": set_member(document)}},
+    )
+    return True
+
+
+async def sync_channel(
+    owner_id: int,
+    channel: str,
+    sticker_type: Literal["regular", "custom_emoji"],
+    priority: int = BULK,
+) -> SyncResult | None:
+    key = (owner_id, channel, sticker_type)
+    if key in syncing:
+        return None
+    syncing.add(key)
+    try:
+        return await sync_sticker_sets(owner_id, channel, sticker_type, priority)
+    finally:
+        syncing.discard(key)
+
+
+async def sync_sticker_sets(
+    user_id: int,
+    channel: str,
+    sticker_type: Literal["regular", "custom_emoji"],
+    priority: int,
+) -> SyncResult | None:
+    sticker_sets = sorted(
+        [
+            document
+            async for document in db.sticker_sets.find(
+                {"owner_id": user_id, "channel": channel, "sticker_type": sticker_type}
+            )
+        ],
+        key=lambda document: document.get("index", 0),
+    )
+    if not sticker_sets:
+        return None
+    sticker_list, _ = await request_sticker_list(channel)
+    channel_cache.invalidate(channel)
+    if isinstance(sticker_list, str):
+        return None
+    upstream = {extract_id(s["urls"][-1]["url"]): s for s in sticker_list}
+    file_ids = {}
+    members = {}
+    for sticker_set in sticker_sets:
+        file_ids[sticker_set["name"]] = await get_set_file_ids(sticker_set["name"])
+        sticker_set["stickers"] = await load_set_members(
+            sticker_set, file_ids[sticker_set["name"]]
+        )
+        members.update((sticker_id, sticker_set) for sticker_id in sticker_set["stickers"])
+
+    removed = [sticker_id for sticker_id in members if sticker_id not in upstream]
+    for sticker_id in removed:
+        sticker_set = members.pop(sticker_id)
+        await remove_set_member(sticker_set, sticker_id, file_ids[sticker_set["name"]])
+
+    semaphore = asyncio.Semaphore(PREPARE_CONCURRENCY)
+    kept = [sticker_id for sticker_id in upstream if sticker_id in members]
+    flags = await asyncio.gather(
+        *(
+            source_changed(upstream[sticker_id], members[sticker_id], sticker_id, semaphore)
+            for sticker_id in kept
+        )
+    )
+    changed = [sticker_id for sticker_id, flag in zip(kept, flags) if flag]
+    added = [sticker_id for sticker_id in upstream if sticker_id not in members]
+    tasks = {
+        sticker_id: asyncio.create_task(
+            prepare_sticker(
+                upstream[sticker_id],
+                user_id,
+                sticker_type,
+                semaphore,
+                priority,
+                sticker_id in members,
+            )
+        )
+        for sticker_id in changed + added
+    }
+    replaced = added_count = 0
+    created = []
+
+    async def on_added(name: str, sticker_ids: list[str]):
+        nonlocal added_count
+        added_count += len(sticker_ids)
+
+    try:
+        for sticker_id in changed:
+            prepared = await tasks[sticker_id]
+            sticker_set = members[sticker_id]
+            if prepared and await replace_set_member(
+                sticker_set, user_id, prepared, file_ids[sticker_set["name"]]
+            ):
+                replaced += 1
+        pending = iter(added)
+        for sticker_set in sticker_sets:
+            while len(sticker_set["stickers"]) < MAX_STICKERS[sticker_type]:
+                sticker_id = next(pending, None)
+                if sticker_id is None:
+                    break
+                prepared = await tasks[sticker_id]
+                if prepared and await add_set_member(sticker_set, user_id, prepared):
+                    added_count += 1
+        overflow = [tasks[sticker_id] for sticker_id in pending]
+        index = sticker_sets[-1].get("index", 0) + 1
+        for start in range(0, len(overflow), MAX_STICKERS[sticker_type]):
+            chunk = overflow[start : start + MAX_STICKERS[sticker_type]]
+            name = await build_sticker_set(
+                user_id, channel, index, sticker_type, chunk, on_added
+            )
+            if name:
+                created.append(name)
+                index += 1
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return SyncResult(added_count, len(removed), replaced, created)
+
+
+async def sync_tracked_channels():
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL)
+        try:
+            tracked = await db.sticker_sets.aggregate(
+                [
+                    {
+                        "$group": {
+                            "_id": {
+                                "owner_id": "$owner_id",
+                                "channel": "$channel",
+                                "sticker_type": "$sticker_type",
+                            }
+                        }
+                    }
+                ]
+            ).to_list(None)
+        except Exception:
+            print(traceback.format_exc())
+            continue
+        for document in tracked:
+            try:
+                await sync_channel(**document["_id"])
+            except SchedulerBusyError:
+                continue
+            except Exception:
+                print(traceback.format_exc())
+
+
+def get_code_index(channel: str, sticker_list: list[dict]) -> CodeIndex:
+    cached = code_indexes.get(channel)
+    if cached and cached[0] is sticker_list:
+        code_indexes.move_to_end(channel)
+        return cached[1]
+    index = CodeIndex(sticker_list)
+    code_indexes[channel] = (sticker_list, index)
+    while len(code_indexes) > CODE_INDEX_SIZE:
+        code_indexes.popitem(last=False)
+    return index
+
+
+async def find_inline_results(
+    channel: str, search: str
+) -> tuple[list[tuple[str, str]], float]:
+    sticker_list = await get_sticker_list(channel)
+    if isinstance(sticker_list, str):
+        return [], INLINE_CACHE_TTL
+    if search:
+        sticker_list = [
+            sticker_list[i]
+            for i in get_code_index(channel, sticker_list).search(search)
+        ]
+        for sticker in sticker_list[:INLINE_PAGE_SIZE]:
+            emote_popularity.record(
+                (channel.lower(), extract_id(sticker["urls"][-1]["url"])), sticker
+            )
+    ids = list(dict.fromkeys(extract_id(s["urls"][-1]["url"]) for s in sticker_list))
+    documents = {}
+    async for document in db.stickers.find(
+        {"sticker_type": "regular", "sticker_id": {"$in": ids}},
+        {"_id": 0, "sticker_id": 1, "file_id": 1, "file_unique_id": 1},
+    ):
+        documents[document["sticker_id"]] = document
+    results = {}
+    for id in ids:
+        if id in documents:
+            document = documents[id]
+            results.setdefault(document["file_unique_id"], document["file_id"])
+    return list(results.items()), INLINE_CACHE_TTL
+
+
+async def report_progress(job: dict, force: bool = False) -> None:
+    now = time()
+    if not force and now - job.get("reported", 0) < STATUS_INTERVAL:
+        return
+    job["reported"] = now
+    counts = build_journal.counts(job)
+    total = len(job["items"])
+    prepared = counts["uploaded"] + counts["added"]
+    text = (
+        f"{job['channel']}: подготовлено {prepared}/{total}, "
+        f"добавлено {counts['added']}/{total}"
+    )
+    link = "addstickers" if job["sticker_type"] == "regular" else "addemoji"
+    for name in job["sets"].values():
+        text += f"\nhttps://t.me/{link}/{name}"
+    try:
+        await limited(
+            telegram_bucket,
+            partial(
+                bot.edit_message_text,
+                text,
+                chat_id=job["chat_id"],
+                message_id=job["message_id"],
+                disable_web_page_preview=True,
+            ),
+        )
+    except TelegramBadRequest:
+        pass
+
+
+async def prepare_job_item(
+    job: dict, sticker_id: str, semaphore: asyncio.Semaphore, priority: int
+) -> tuple[str, InputSticker, dict] | None:
+    item = job["items"][sticker_id]
+    if item["state"] != "uploaded":
+        prepared = await prepare_sticker(
+            item["sticker"],
+            job["owner_id"],
+            job["sticker_type"],
+            semaphore,
+            priority,
+            progress=partial(build_journal.mark, job, sticker_id),
+        )
+        if not prepared:
+            return None
+        _, _, document = prepared
+        await build_journal.mark(
+            job, sticker_id, "uploaded", **set_member(document), format=document["format"]
+        )
+        await report_progress(job)
+        item = job["items"][sticker_id]
+    input_sticker = InputSticker(
+        sticker=item["file_id"],
+        format=item["format"],
+        emoji_list=["🪱"],
+        keywords=[item["sticker"]["code"]],
+    )
+    return sticker_id, input_sticker, item
+
+
+async def reconcile_job(job: dict, max_amount: int) -> None:
+    for index in range(math.ceil(len(job["order"]) / max_amount)):
+        name = sticker_set_name(job["channel"], job["sticker_type"], index)
+        try:
+            file_ids = await get_set_file_ids(name)
+        except TelegramBadRequest:
+            continue
+        chunk = job["order"][index * max_amount : (index + 1) * max_amount]
+        present = [
+            sticker_id
+            for sticker_id in chunk
+            if job["items"][sticker_id].get("file_unique_id") in file_ids
+        ]
+        await record_set_members(
+            job["owner_id"],
+            job["channel"],
+            job["sticker_type"],
+            index,
+            {sticker_id: job["items"][sticker_id] for sticker_id in present},
+        )
+        await build_journal.add(job, index, name, present)
+
+
+async def run_build_job(job: dict, resume: bool = False) -> None:
+    max_amount = MAX_STICKERS[job["sticker_type"]]
+    semaphore = asyncio.Semaphore(PREPARE_CONCURRENCY)
+    tasks = {}
+    try:
+        if resume:
+            await reconcile_job(job, max_amount)
+        for i, sticker_id in enumerate(job["order"]):
+            if job["items"][sticker_id]["state"] == "added":
+                continue
+            tasks[sticker_id] = asyncio.create_task(
+                prepare_job_item(
+                    job, sticker_id, semaphore, INTERACTIVE if i == 0 else BULK
+                )
+            )
+        for index in range(math.ceil(len(job["order"]) / max_amount)):
+            chunk = job["order"][index * max_amount : (index + 1) * max_amount]
+
+            async def on_added(name: str, sticker_ids: list[str], index=index):
+                await build_journal.add(job, index, name, sticker_ids)
+                await report_progress(job)
+
+            await build_sticker_set(
+                job["owner_id"],
+                job["channel"],
+                index,
+                job["sticker_type"],
+                [tasks[sticker_id] for sticker_id in chunk if sticker_id in tasks],
+                on_added,
+                str(index) in job["sets"],
+            )
+        await build_journal.finish(job, DONE)
+    except Exception as e:
+        if not isinstance(e, (SchedulerBusyError, TelegramAPIError)):
+            print(traceback.format_exc())
+        await build_journal.finish(job, FAILED)
+        text = (
+            "Бот сейчас перегружен, попробуйте позже."
+            if isinstance(e, SchedulerBusyError)
+            else "Не удалось собрать набор."
+        )
+        try:
+            await limited(
+                telegram_bucket, partial(bot.send_message, job["chat_id"], text)
+            )
+        except TelegramAPIError:
+            pass
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+    await report_progress(job, True)
+
+
+def start_build_job(job: dict, resume: bool = False) -> None:
+    task = asyncio.create_task(run_build_job(job, resume))
+    build_tasks.add(task)
+    task.add_done_callback(build_tasks.discard)
+
+
+async def run_command(command: Awaitable[None]) -> None:
+    try:
+        await command
+    except Exception:
+        print(traceback.format_exc())
+
+
+def start_command(command: Awaitable[None]) -> None:
+    task = asyncio.create_task(run_command(command))
+    command_tasks.add(task)
+    task.add_done_callback(command_tasks.discard)
 
 
 async def create_sticker_set(
@@ -146,63 +944,205 @@ async def create_sticker_set(
     state: MongoStorage,
     sticker_type: Literal["regular", "custom_emoji"],
 ):
-    MAX_AMOUNT = {"regular": 120, "custom_emoji": 200}[sticker_type]
     args = message.text.split()
 
     if len(args) != 2:
         return
 
     sticker_set = await db.sticker_sets.find_one(
-        {"owner_id": message.from_user.id, "channel": args[1]}
+        {
+            "owner_id": message.from_user.id,
+            "channel": args[1],
+            "sticker_type": sticker_type,
+        },
+        {"_id": 1},
     )
     if sticker_set:
-        return
+        return await message.answer(
+            f"Набор для этого канала уже есть, обновить его: /sync {args[1]}"
+        )
+    if await build_journal.find_running(message.from_user.id, args[1], sticker_type):
+        return await message.answer("Этот набор уже собирается.")
 
     sticker_list = await get_sticker_list(args[1])
     if isinstance(sticker_list, str):
         return await message.answer(sticker_list)
+    channel_popularity.record(args[1].lower())
 
-    amount_of_sets = math.ceil(len(sticker_list) / MAX_AMOUNT)
-    await message.answer(f"{amount_of_sets}")
-    name = f"{args[1]}_{sticker_type}_by_{bot_account.username}"
-    await bot.create_new_sticker_set(
-        bot_account.id,
-        name,
-        f"Twitch {args[1]} by @{bot_account.username}",
-        stickers=[
-            await upload_sticker(sticker_list[0], message.from_user.id, sticker_type)
-        ],
-        sticker_type=sticker_type,
+    status = await message.answer(f"{args[1]}: подготовлено 0/{len(sticker_list)}")
+    stickers = {extract_id(s["urls"][-1]["url"]): s for s in sticker_list}
+    job = await build_journal.create(
+        message.from_user.id,
+        message.chat.id,
+        status.message_id,
+        args[1],
+        sticker_type,
+        stickers,
     )
-    for sticker in sticker_list[1:5]:
-        await add_sticker_to_set(sticker, message.from_user.id, name, sticker_type)
+    start_build_job(job)
 
 
-async def startup():
-    global session, bot_account
-    bot_account = await bot.get_me()
+async def warm_candidates() -> list[dict]:
+    channels = [channel for channel, _ in channel_popularity.top(WARM_CHANNELS)]
+    if not channels:
+        return []
+    candidates = [sticker for _, sticker in emote_popularity.top(WARM_EMOTES)]
+    for channel in channels + [GLOBAL_CHANNEL]:
+        sticker_list = await get_sticker_list(channel)
+        if not isinstance(sticker_list, str):
+            candidates += sticker_list
+    unique = {}
+    for sticker in candidates:
+        unique.setdefault(extract_id(sticker["urls"][-1]["url"]), sticker)
+    warm = set()
+    async for document in db.stickers.find(
+        {"sticker_type": "regular", "sticker_id": {"$in": list(unique)}},
+        {"_id": 0, "sticker_id": 1},
+    ):
+        warm.add(document["sticker_id"])
+    return [candidate for id, candidate in unique.items() if id not in warm]
+
+
+def idle() -> bool:
+    return not scheduler.queued and not build_tasks and not syncing
+
+
+async def warm_popular_emotes() -> int:
+    warmed = 0
+    semaphore = asyncio.Semaphore(1)
+    for sticker in await warm_candidates():
+        if warmed >= WARM_CONVERSIONS or not idle():
+            break
+        await warm_bucket.acquire()
+        if not idle():
+            break
+        if await prepare_sticker(
+            sticker, WARM_UPLOADER_ID, "regular", semaphore, BULK
+        ):
+            warmed += 1
+    return warmed
+
+
+async def warm_loop():
+    while True:
+        await asyncio.sleep(WARM_INTERVAL)
+        if not WARM_UPLOADER_ID or not idle():
+            continue
+        try:
+            await warm_popular_emotes()
+        except SchedulerBusyError:
+            continue
+        except Exception:
+            print(traceback.format_exc())
+
+
+async def get_bot_account() -> User:
+    key = f"account:{TOKEN.split(':', 1)[0]}"
+    cached = await db.bot_state.find_one({"_id": key}, {"account": 1, "updated": 1})
+    if cached and time() - cached["updated"] < ACCOUNT_TTL:
+        return User.model_validate(cached["account"])
+    account = await bot.get_me()
+    await db.bot_state.replace_one(
+        {"_id": key},
+        {"account": account.model_dump(exclude_none=True), "updated": time()},
+        upsert=True,
+    )
+    return account
+
+
+async def configure_webhook() -> None:
+    key = f"webhook:{TOKEN.split(':', 1)[0]}"
+    secret_hash = hashlib.sha256((SECRET or "").encode()).hexdigest()
+    info, state = await asyncio.gather(
+        bot.get_webhook_info(), db.bot_state.find_one({"_id": key})
+    )
+    if (
+        info.url == WEBHOOK
+        and sorted(info.allowed_updates or []) == sorted(ALLOWED_UPDATES)
+        and state
+        and state.get("secret_hash") == secret_hash
+    ):
+        return
     assert await bot.set_webhook(
-        WEBHOOK,
-        allowed_updates=[
-            "message",
-            "inline_query",
-            "chosen_inline_result",
-            "callback_query",
-        ],
-        secret_token=SECRET,
+        WEBHOOK, allowed_updates=ALLOWED_UPDATES, secret_token=SECRET
+    )
+    await db.bot_state.replace_one(
+        {"_id": key}, {"url": WEBHOOK, "secret_hash": secret_hash}, upsert=True
+    )
+
+
+async def startup():
+    global session, bot_account, conversion_cache, downloader, sync_task, warm_task
+    bot_account, *_ = await asyncio.gather(
+        get_bot_account(),
+        configure_webhook(),
+        ensure_indexes(db),
+        *([conversion_queue.create_indexes()] if CONVERSION_QUEUE else []),
+    )
+    conversion_cache = ConversionCache(
+        asyncio.get_running_loop(), CONVERSION_CACHE_DIR, CONVERSION_CACHE_SIZE
     )
-    session = aiohttp.ClientSession()
+    download_cache = ConversionCache(
+        asyncio.get_running_loop(), DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_SIZE
+    )
+    await asyncio.gather(conversion_cache.open(), download_cache.open())
+    session = create_session()
+    downloader = Downloader(session, download_cache, MAX_DOWNLOAD_SIZE)
+    scheduler.start()
+    sync_task = asyncio.create_task(sync_tracked_channels())
+    warm_task = asyncio.create_task(warm_loop())
+    async for job in build_journal.running():
+        start_build_job(job, True)
 
 
 async def shutdown():
-    await bot.delete_webhook()
+    sync_task.cancel()
+    warm_task.cancel()
+    for task in list(build_tasks) + list(command_tasks):
+        task.cancel()
+    await asyncio.gather(*build_tasks, *command_tasks, return_exceptions=True)
+    await scheduler.stop()
     await session.close()
     client.close()
 
 
 @dp.message(Command("delete"))
 async def delete(message: Message):
-    await bot.delete_sticker_set(message.text.split()[1])
+    name = message.text.split()[1]
+    await bot.delete_sticker_set(name)
+    await db.sticker_sets.delete_one({"owner_id": message.from_user.id, "name": name})
+
+
+async def sync_command(message: Message, channel: str):
+    results = []
+    try:
+        for sticker_type in STICKER_TYPES:
+            result = await sync_channel(
+                message.from_user.id, channel, sticker_type, INTERACTIVE
+            )
+            if result:
+                results.append((sticker_type, result))
+    except SchedulerBusyError:
+        return await message.answer("Бот сейчас перегружен, попробуйте позже.")
+    if not results:
+        return await message.answer("Для этого канала нет наборов.")
+    for sticker_type, result in results:
+        link = "addstickers" if sticker_type == "regular" else "addemoji"
+        await message.answer(
+            f"Добавлено: {result.added}, удалено: {result.removed}, "
+            f"обновлено: {result.replaced}"
+        )
+        for name in result.created:
+            await message.answer(f"https://t.me/{link}/{name}")
+
+
+@dp.message(Command("sync"))
+async def command_sync(message: Message):
+    args = message.text.split()
+    if len(args) != 2:
+        return
+    channel_popularity.record(args[1].lower())
+    start_command(sync_command(message, args[1]))
 
 
 @dp.message(CommandStart())
@@ -222,27 +1162,27 @@ async def command_emoji(message: Message, state: MongoStorage):
 
 @dp.inline_query()
 async def inline_query_handler(inline_query: InlineQuery):
-    if not inline_query.query:
+    args = inline_query.query.split()
+    if not args or len(args) > 2:
         return
-    elif len(inline_query.query.split()) == 1:
-        sticker_list = await get_sticker_list(inline_query.query)
-        if isinstance(sticker_list, str):
-            return
-        results = []
-        for sticker in sticker_list[:1]:
-            url = sticker["urls"][-1]["url"]
-            id = extract_id(url)
-            db_sticker = await db.stickers.find_one(
-                {
-                    "sticker_type": "regular",
-                    "sticker_id": id,
-                }
+    channel = args[0]
+    search = args[1] if len(args) == 2 else ""
+    results = await inline_cache.get(
+        (channel.lower(), search.lower()),
+        partial(find_inline_results, channel, search),
+    )
+    if results:
+        channel_popularity.record(channel.lower(), weight=0.25)
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    end = offset + INLINE_PAGE_SIZE
+    await bot.answer_inline_query(
+        inline_query.id,
+        [
+            InlineQueryResultCachedSticker(
+                type="sticker", id=file_unique_id, sticker_file_id=file_id
             )
-            if not db_sticker:
-                continue
-            # print(await bot.get_file(db_sticker["file_id"]))
-            # results.append(InlineQueryResultCachedDocument(type="document", id=id, title=sticker["code"], document_file_id=db_sticker["file_id"]))
-            # await bot.send_sticker(inline_query.from_user.id, db_sticker["file_id"])
-            results.append(InlineQueryResultCachedSticker(type="sticker", id=db_sticker["file_unique_id"], sticker_file_id=db_sticker["file_id"]))
-            # results.append(InlineQueryResultCachedSticker(type="photo", id=db_sticker["file_unique_id"], sticker_file_id=db_sticker["file_id"]))
-        await bot.answer_inline_query(inline_query.id, results, cache_time=30)
+            for file_unique_id, file_id in results[offset:end]
+        ],
+        cache_time=30,
+        next_offset=str(end) if end < len(results) else "",
+    )
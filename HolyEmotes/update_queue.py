@@ -0,0 +1,93 @@
+import asyncio
+import traceback
+from collections import deque
+from typing import Awaitable, Callable
+
+from aiogram.types.update import Update
+
+
+def chat_key(update: Update) -> int:
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(
+        getattr(event, "message", None), "chat", None
+    )
+    if chat:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user else update.update_id
+
+
+class UpdateQueue:
+    def __init__(
+        self,
+        handler: Callable[[Update], Awaitable[object]],
+        workers: int = 8,
+        max_size: int = 1000,
+    ) -> None:
+        self._handler = handler
+        self._worker_count = workers
+        self._max_size = max_size
+        self._chats: dict[int, deque[Update]] = {}
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._depth = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._workers: list[asyncio.Task] = []
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.overflows = 0
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def start(self) -> None:
+        self._workers = [
+            asyncio.create_task(self.__worker()) for _ in range(self._worker_count)
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def put(self, update: Update) -> bool:
+        if self._depth >= self._max_size:
+            self.overflows += 1
+            return False
+        key = chat_key(update)
+        pending = self._chats.get(key)
+        if pending is None:
+            pending = self._chats[key] = deque()
+            self._ready.put_nowait(key)
+        pending.append(update)
+        self._depth += 1
+        self._drained.clear()
+        self.enqueued += 1
+        return True
+
+    async def __worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._chats[key]
+            update = pending.popleft()
+            try:
+                await self._handler(update)
+            except Exception:
+                self.failed += 1
+                print(traceback.format_exc())
+            finally:
+                self.processed += 1
+                self._depth -= 1
+                if pending:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                if not self._depth:
+                    self._drained.set()
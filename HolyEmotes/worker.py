@@ -0,0 +1,84 @@
+import asyncio
+import os
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from conversion_queue import ConversionQueue
+from convert import Converter
+from formats.utils import set_executor
+
+load_dotenv()
+MONGODB = os.getenv("MONGODB")
+WORKER_SLOTS = int(os.getenv("WORKER_SLOTS", os.cpu_count() or 1))
+POLL_INTERVAL = 1.0
+
+
+async def convert(job: dict) -> tuple[dict[str, tuple[bytes, str]], dict]:
+    converter = Converter(
+        asyncio.get_running_loop(), bytes(job["source"]), job["sticker_types"][0]
+    )
+    results = await converter.convert_renditions(job["sticker_types"])
+    return results, converter.errors
+
+
+async def process(queue: ConversionQueue, worker_id: str, job: dict) -> None:
+    task = asyncio.create_task(convert(job))
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=queue.lease / 3)
+        if done:
+            break
+        if not await queue.heartbeat(job, worker_id):
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return
+    try:
+        results, errors = task.result()
+    except Exception as e:
+        traceback.print_exc()
+        await queue.fail(job, worker_id, e)
+    else:
+        await queue.complete(job, worker_id, results, errors)
+
+
+async def work(queue: ConversionQueue, worker_id: str) -> None:
+    while True:
+        job = await queue.claim(worker_id)
+        if not job:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+        await process(queue, worker_id, job)
+
+
+async def sweep(queue: ConversionQueue) -> None:
+    while True:
+        await asyncio.sleep(queue.lease)
+        try:
+            await queue.sweep()
+        except Exception:
+            traceback.print_exc()
+
+
+async def main() -> None:
+    client = AsyncIOMotorClient(MONGODB)
+    queue = ConversionQueue(client.HolyStickers.conversion_jobs)
+    await queue.create_indexes()
+    executor = ThreadPoolExecutor(WORKER_SLOTS, "convert")
+    set_executor(executor)
+    prefix = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+    try:
+        await asyncio.gather(
+            sweep(queue),
+            *(work(queue, f"{prefix}-{slot}") for slot in range(WORKER_SLOTS)),
+        )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())